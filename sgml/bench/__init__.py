@@ -0,0 +1,221 @@
+"""
+Benchmarks for the interpreter. Run them with
+
+    python3 -m sgml.bench [ --compile ] [ --repeat N ] [ -o results.json ] [ name ... ]
+
+and check one set of results against another with
+
+    python3 -m sgml.bench compare baseline.json results.json
+
+Each benchmark is timed `repeat` times after a warm-up run, and then run once
+more under tracemalloc for its peak memory and the number of trampoline steps
+it took (see sgml.interpreter.step_count; the compiled evaluator only takes
+steps where it falls back to frames).
+"""
+import os
+import platform
+import time
+import tracemalloc
+
+import sgml.interpreter
+import sgml.interpreter.compiler
+import sgml.reader
+import sgml.rt
+from sgml.reader.streams import StringStream
+
+# Bump when the benchmarks change enough that old results aren't comparable
+RESULTS_VERSION = 1
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    Register a benchmark: func(evaluate) -> func() that does the work to be
+    measured. The outer function does any setup, and the work may be repeated.
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def _eval(evaluate, code):
+    result = None
+    for form in sgml.reader.iter_forms(sgml.rt, sgml.reader.INITIAL_MACROS, StringStream(code)):
+        result = evaluate(sgml.rt, form)
+    return result
+
+
+def _program(evaluate, definitions, code):
+    sgml.rt.init()
+    _eval(evaluate, definitions)
+    forms = list(sgml.reader.iter_forms(sgml.rt, sgml.reader.INITIAL_MACROS, StringStream(code)))
+
+    def run():
+        for form in forms:
+            evaluate(sgml.rt, form)
+    return run
+
+
+@benchmark("reader")
+def reader(evaluate):
+    sources = []
+    for name in ("core.sgml", "fp.sgml", "lists.sgml"):
+        with open(os.path.join(os.path.dirname(sgml.rt.__file__), "lib", name)) as f:
+            sources.append(f.read())
+    code = "\n".join(sources) * 100
+    sgml.rt.init()
+    return lambda: sgml.reader.read_many(sgml.rt, sgml.reader.INITIAL_MACROS, StringStream(code))
+
+
+@benchmark("fib")
+def fib(evaluate):
+    return _program(evaluate, """
+        (defn fibonacci (n)
+          (cond ((< n 2) n)
+                (t (+ (fibonacci (- n 2)) (fibonacci (- n 1))))))
+    """, "(fibonacci 17)")
+
+
+@benchmark("ackermann")
+def ackermann(evaluate):
+    return _program(evaluate, """
+        (defn ackermann (m n)
+          (cond ((eq m 0) (+ n 1))
+                ((eq n 0) (ackermann (- m 1) 1))
+                (t (ackermann (- m 1) (ackermann m (- n 1))))))
+    """, "(ackermann 2 40)")
+
+
+@benchmark("lists")
+def lists(evaluate):
+    numbers = " ".join(str(i) for i in range(200))
+    return _program(evaluate, """
+        (require lists)
+        (define numbers '({}))
+    """.format(numbers), """
+        (foldr + 0 (maplist numbers (lambda (x) (* x x))))
+        (lists::append* numbers numbers numbers)
+    """)
+
+
+@benchmark("generators")
+def generators(evaluate):
+    numbers = " ".join(str(i) for i in range(200))
+    return _program(evaluate, """
+        (defn generate-one-element-at-a-time (lst)
+          (defn control-state (return)
+            (for-each
+              (lambda (element)
+                (define return (call/cc
+                                 (lambda (resume-here)
+                                   (set! control-state resume-here)
+                                   (return element)))))
+              lst)
+            (return 'done))
+          (defn generator ()
+            (call/cc control-state))
+          generator)
+
+        (defn drain (generator)
+          (cond ((eq (generator) 'done) 'done)
+                (t (drain generator))))
+    """, "(drain (generate-one-element-at-a-time '({})))".format(numbers))
+
+
+@benchmark("require")
+def require(evaluate):
+    sgml.rt.init()
+
+    def run():
+        sgml.rt.reset()
+        _eval(evaluate, "(require lists)")
+    return run
+
+
+@benchmark("init")
+def init(evaluate):
+    def run():
+        sgml.rt._cached_core_ns = None
+        sgml.rt.init()
+    return run
+
+
+@benchmark("init-without-image")
+def init_without_image(evaluate):
+    def run():
+        image_dir = sgml.rt.IMAGE_DIR
+        sgml.rt.IMAGE_DIR = None
+        try:
+            sgml.rt._cached_core_ns = None
+            sgml.rt.init()
+        finally:
+            sgml.rt.IMAGE_DIR = image_dir
+    return run
+
+
+def run_benchmark(name, evaluate=sgml.interpreter.evaluate, repeat=5):
+    """
+    :return: A dict of the benchmark's results: its best and mean wall time in
+        seconds, the steps it took and its peak memory in bytes
+    """
+    run = BENCHMARKS[name](evaluate)
+    run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    steps = sgml.interpreter.step_count
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "wall_time": min(times),
+        "mean_wall_time": sum(times) / len(times),
+        "repeat": repeat,
+        "steps": sgml.interpreter.step_count - steps,
+        "peak_memory": peak_memory,
+    }
+
+
+def run_benchmarks(names=None, compiled=False, repeat=5):
+    """
+    :return: A JSON-serializable dict of results for the named benchmarks, or all of them
+    """
+    evaluate = sgml.interpreter.compiler.evaluate if compiled else sgml.interpreter.evaluate
+    results = {name: run_benchmark(name, evaluate, repeat) for name in (names or BENCHMARKS)}
+    sgml.rt.init()
+    return {
+        "version": RESULTS_VERSION,
+        "evaluator": "compiled" if compiled else "frames",
+        "python": platform.python_version(),
+        "benchmarks": results,
+    }
+
+
+def compare(baseline, results, threshold=0.1):
+    """
+    :param threshold: How much worse than the baseline (as a fraction) a
+        result can be before it's a regression
+    :return: A list of (benchmark, measure, baseline value, new value, is
+        regression) for each measure of each benchmark in both sets of results
+    """
+    if baseline.get("version") != results.get("version"):
+        raise ValueError("Results are from different versions of the benchmarks")
+    comparison = []
+    for name, old in baseline["benchmarks"].items():
+        new = results["benchmarks"].get(name)
+        if new is None:
+            continue
+        for measure in ("wall_time", "steps", "peak_memory"):
+            # steps are deterministic, so any increase is a regression
+            allowance = 0 if measure == "steps" else threshold
+            regression = new[measure] > old[measure] * (1 + allowance)
+            comparison.append((name, measure, old[measure], new[measure], regression))
+    return comparison
@@ -0,0 +1,76 @@
+import json
+import sys
+
+import sgml.bench
+
+USAGE = """Usage: python3 -m sgml.bench [ --compile ] [ --repeat <n> ] [ -o <results.json> ] [ name ... ]
+       python3 -m sgml.bench compare [ --threshold <fraction> ] <baseline.json> <results.json>
+Benchmarks: """ + " ".join(sgml.bench.BENCHMARKS)
+
+
+def run(args):
+    compiled = False
+    repeat = 5
+    output = None
+    names = []
+    i = 0
+    while i < len(args):
+        if args[i] in ("-C", "--compile"):
+            compiled = True
+        elif args[i] == "--repeat":
+            i += 1
+            repeat = int(args[i])
+        elif args[i] in ("-o", "--output"):
+            i += 1
+            output = args[i]
+        elif args[i] in sgml.bench.BENCHMARKS:
+            names.append(args[i])
+        else:
+            print(USAGE)
+            return 1
+        i += 1
+
+    results = sgml.bench.run_benchmarks(names, compiled=compiled, repeat=repeat)
+    text = json.dumps(results, indent=2)
+    if output is None:
+        print(text)
+    else:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    return 0
+
+
+def compare(args):
+    threshold = 0.1
+    if len(args) > 1 and args[0] == "--threshold":
+        threshold = float(args[1])
+        args = args[2:]
+    if len(args) != 2:
+        print(USAGE)
+        return 1
+    with open(args[0]) as f:
+        baseline = json.load(f)
+    with open(args[1]) as f:
+        results = json.load(f)
+
+    regressions = 0
+    for name, measure, old, new, regression in sgml.bench.compare(baseline, results, threshold):
+        change = (new - old) / old if old else 0.0
+        print("{:12} {:12} {:>14.6g} {:>14.6g} {:>+8.1%}{}".format(
+            name, measure, old, new, change, "  REGRESSION" if regression else ""
+        ))
+        regressions += regression
+    return 1 if regressions else 0
+
+
+def main(args):
+    if any(a in ("-h", "-help", "--help", "-?") for a in args[1:]):
+        print(USAGE)
+        return 0
+    if args[1:2] == ["compare"]:
+        return compare(args[2:])
+    return run(args[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,37 +1,61 @@
+from types import MappingProxyType
+
+# A slot in a LexicalScope whose binding hasn't been made yet
+UNBOUND = object()
+
+_NO_BINDINGS = MappingProxyType({})
+
+
 class Namespace:
-    def __init__(self, name, symbols=None):
+    """
+    A namespace's definitions are its own `env` layered over `base`, a read-only
+    mapping that may be shared with other namespaces (normally the stdlib, see
+    sgml.rt.stdlib_env). Definitions always go in `env`, so a namespace is
+    isolated from the others however cheaply it was made.
+    """
+    def __init__(self, name, symbols=None, base=_NO_BINDINGS):
         self.name = name
         self.env = {} if symbols is None else symbols
+        self.base = base
         self.imports = {}
 
     def add_import(self, other, alias=None):
         self.imports[alias or other.name.text] = other
 
     def include(self, other):
+        self.env.update(other.base)
         self.env.update(other.env)
 
     def define(self, symbol, value):
         assert symbol.ns is None, "Can't define namespaced symbol {}".format(symbol)
-        self.env[symbol.text] = value
+        self.env[symbol] = value
 
     def get(self, symbol):
-        if symbol.ns and symbol.ns != self.name.text:
-            assert symbol.ns in self.imports, "Undefined namespace {}".format(symbol.ns)
-            return self.imports[symbol.ns].get(symbol)
-        if symbol.text not in self.env:
-            print(self.env)
-        assert symbol.text in self.env, "Undefined symbol {}".format(symbol)
-        return self.env[symbol.text]
+        # namespaced symbols are never defined, so they miss both layers
+        if symbol in self.env:
+            return self.env[symbol]
+        if symbol in self.base:
+            return self.base[symbol]
+        if symbol.ns:
+            if symbol.ns != self.name.text:
+                assert symbol.ns in self.imports, "Undefined namespace {}".format(symbol.ns)
+                return self.imports[symbol.ns].get(symbol)
+            return self.get(symbol.without_ns())
+        print(self.env)
+        raise AssertionError("Undefined symbol {}".format(symbol))
 
     def set(self, symbol, value):
         assert symbol.ns is None, "Can't define namespaced symbol {}".format(symbol)
-        # assert symbol.text in self.env, "Undefined symbol {}".format(symbol)
-        self.env[symbol.text] = value
+        # assert symbol in self.env, "Undefined symbol {}".format(symbol)
+        self.env[symbol] = value
 
     def scope(self):
         return Scope(env={}, parent=None, ns=self)
 
 class Scope:
+    # symbol -> slot in self.values, for scopes laid out by the compiler
+    layout = None
+
     def __init__(self, env: dict, parent, ns):
         self.env = env
         self.parent = parent
@@ -46,15 +70,23 @@ class Scope:
         """
         if not rt.is_symbol(symbol):
             raise TypeError("get called with non-symbol {} ({})".format(symbol, type(symbol)))
-        if symbol.text in self.env:
-            return self.env[symbol.text]
-        if self.parent is not None:
-            return self.parent.get(rt, symbol)
-        return self.ns.get(symbol)
+        scope = self
+        while True:
+            env = scope.env
+            if symbol in env:
+                return env[symbol]
+            if scope.layout is not None and symbol in scope.layout:
+                value = scope.values[scope.layout[symbol]]
+                if value is not UNBOUND:
+                    return value
+            if scope.parent is None:
+                return scope.ns.get(symbol)
+            scope = scope.parent
 
     def ns_define(self, rt, symbol, form):
         if not rt.is_symbol(symbol):
             raise TypeError("define called with non-symbol {} ({})".format(symbol, type(symbol)))
+        rt.name_combiner(form, symbol)
         self.ns.define(symbol, form)
 
     def ns_set(self, rt, symbol, form):
@@ -67,7 +99,7 @@ class Scope:
             raise TypeError("add called with non-symbol {} ({})".format(symbol, type(symbol)))
         if symbol.text == "_":
             return
-        self.env[symbol.text] = form
+        self.env[symbol] = form
 
     def set(self, rt, symbol, form):
         if not rt.is_symbol(symbol):
@@ -76,7 +108,7 @@ class Scope:
             return
 
         if symbol in self.env:
-            self.env[symbol.text] = form
+            self.env[symbol] = form
         elif self.parent is not None:
             self.parent.set(rt, symbol, form)
         else:
@@ -97,6 +129,42 @@ class Scope:
     def set_ns(self, ns):
         self.ns = ns
 
+
+class LexicalScope(Scope):
+    """
+    A scope laid out ahead of time by sgml.interpreter.compiler: `layout` maps
+    each symbol the compiler expects to be bound here to a slot in `values`, so
+    compiled code can find it by (depth, slot) without probing any dicts.
+
+    A binding the compiler didn't foresee (e.g. a `label` in code passed to `eval`
+    through a reified environment) goes in `env` like in any other Scope. Compiled
+    variable references check `env` on the way up and fall back to get() when
+    it's nonempty, since the new binding may shadow what they resolved statically.
+    """
+    def __init__(self, layout, parent, ns, values=None):
+        super(LexicalScope, self).__init__(_NO_BINDINGS, parent, ns)
+        self.layout = layout
+        self.values = [UNBOUND] * len(layout) if values is None else values
+
+    def add(self, rt, symbol, form):
+        if not rt.is_symbol(symbol):
+            raise TypeError("add called with non-symbol {} ({})".format(symbol, type(symbol)))
+        if symbol.text == "_":
+            return
+        if symbol in self.layout:
+            self.values[self.layout[symbol]] = form
+            return
+        if self.env is _NO_BINDINGS:
+            self.env = {}
+        self.env[symbol] = form
+
+    def set(self, rt, symbol, form):
+        if rt.is_symbol(symbol) and symbol in self.layout and self.values[self.layout[symbol]] is not UNBOUND:
+            self.values[self.layout[symbol]] = form
+            return
+        super(LexicalScope, self).set(rt, symbol, form)
+
+
 def traverse_symbol_tree(rt, tree, obj, f):
     """
     Match the formal parameter tree to an object.
@@ -1,12 +1,20 @@
+import copy
 import sys
 
 _print_stack_trace = True
 
 
 class StackFrame:
+    """
+    Frames are updated in place as they receive values and work through their
+    evaluends. Once a continuation captures a frame, it and all of its ancestors
+    are marked shared, and from then on any update goes to a fresh copy instead,
+    so the continuation can be resumed any number of times.
+    """
     def __init__(self, scope, parent):
         self.scope = scope
         self.parent = parent
+        self.shared = False
 
     def with_value(self, rt, value):
         raise NotImplementedError("subclass responsibility")
@@ -14,6 +22,29 @@ class StackFrame:
     def frame_or_value(self, rt):
         raise NotImplementedError("subclass responsibility")
 
+    def writable(self):
+        """
+        :return: self, or a private copy of self if a continuation holds it
+        """
+        if self.shared:
+            return self.copy()
+        return self
+
+    def copy(self):
+        result = copy.copy(self)
+        result.shared = False
+        return result
+
+
+def share(frame):
+    """
+    Mark `frame` and its ancestors as held by a continuation. Ancestors of a
+    shared frame are always shared, so we can stop at the first one we find.
+    """
+    while frame is not None and not frame.shared:
+        frame.shared = True
+        frame = frame.parent
+
 
 class RuntimeErrorFrame(StackFrame):
     __missing = object()
@@ -42,29 +73,37 @@ class CondStackFrame(StackFrame):
     __missing = object()
 
     def __init__(self, scope, parent, branches):
+        """
+        :param branches: Tuple from cond_branches()
+        """
         super(CondStackFrame, self).__init__(scope, parent)
         self.branches = branches
+        self.index = 0
         self.last_predicate_value = self.__missing
 
     def with_value(self, rt, value):
-        result = CondStackFrame(self.scope, self.parent, self.branches)
+        result = self.writable()
         result.last_predicate_value = value
         return result
 
     def frame_or_value(self, rt):
-        if rt.is_null(self.branches):
+        if self.index == len(self.branches):
             return RuntimeErrorFrame(self.scope, self.parent, "no matches in cond")
-        if rt.length(rt.first(self.branches)) != 2:
-            return RuntimeErrorFrame(self.scope, self, "should be two elements in a cond-pair", rt.first(self.branches))
+        predicate, consequent = self.branches[self.index]
+        if predicate is None:
+            return RuntimeErrorFrame(self.scope, self, "should be two elements in a cond-pair", consequent)
 
         if self.last_predicate_value is self.__missing:
-            return DispatchStackFrame(self.scope, self, rt.first(rt.first(self.branches)))
+            return DispatchStackFrame(self.scope, self, predicate)
         if rt.is_truthy(self.last_predicate_value):
-            return DispatchStackFrame(self.scope, self.parent, rt.second(rt.first(self.branches)))
-        return CondStackFrame(self.scope, self.parent, rt.rest(self.branches))
+            return DispatchStackFrame(self.scope, self.parent, consequent)
+        result = self.writable()
+        result.index = self.index + 1
+        result.last_predicate_value = self.__missing
+        return result
 
     def __str__(self):
-        return "{} branches={}".format(self.__class__.__name__, self.branches)
+        return "{} branches={}".format(self.__class__.__name__, self.branches[self.index:])
 
 class EvalStackFrame(StackFrame):
     __missing = object()
@@ -77,12 +116,13 @@ class EvalStackFrame(StackFrame):
 
     def with_value(self, rt, value):
         if self.eval_value is self.__missing:
-            result = EvalStackFrame(self.scope, self.parent, formlist=rt.rest(self.formlist))
+            result = self.writable()
+            result.formlist = rt.rest(self.formlist)
             result.eval_value = value
             return result
         if self.env_value is self.__missing:
-            result = EvalStackFrame(self.scope, self.parent, formlist=rt.rest(self.formlist))
-            result.eval_value = self.eval_value
+            result = self.writable()
+            result.formlist = rt.rest(self.formlist)
             result.env_value = value
             return result
         return RuntimeErrorFrame(self.scope, self.parent, "with_value called too many times")
@@ -108,7 +148,7 @@ class DefineStackFrame(StackFrame):
 
     def with_value(self, rt, value):
         if self.form_value is self.__missing:
-            result = DefineStackFrame(self.scope, self.parent, self.head, self.tree, self.form)
+            result = self.writable()
             result.form_value = value
             return result
         return RuntimeErrorFrame(self.scope, self, "with_value called too many times")
@@ -137,7 +177,7 @@ class LabelStackFrame(StackFrame):
 
     def with_value(self, rt, value):
         if self.form_value is self.__missing:
-            result = LabelStackFrame(self.scope, self.parent, self.label, self.form)
+            result = self.writable()
             result.form_value = value
             return result
         return RuntimeErrorFrame(self.scope, self, "with_value called too many times")
@@ -145,6 +185,8 @@ class LabelStackFrame(StackFrame):
     def frame_or_value(self, rt):
         if self.form_value is self.__missing:
             return DispatchStackFrame(self.scope, self, self.form)
+        if rt.is_symbol(self.label):
+            rt.name_combiner(self.form_value, self.label)
         self.scope.add_match(rt, tree=self.label, obj=self.form_value)
         return self.form_value
 
@@ -156,28 +198,38 @@ class LetStackFrame(StackFrame):
     __missing = object()
 
     def __init__(self, scope, parent, bindings, body):
+        """
+        :param bindings: Tuple from let_bindings()
+        """
         super(LetStackFrame, self).__init__(scope.child_scope(), parent)
         self.bindings = bindings
+        self.index = 0
         self.body = body
         self.next_binding_value = self.__missing
 
     def with_value(self, rt, value):
-        result = LetStackFrame(self.scope, self.parent, self.bindings, self.body)
+        result = self.writable()
         result.next_binding_value = value
         return result
 
     def frame_or_value(self, rt):
-        if rt.is_null(self.bindings):
+        if self.index == len(self.bindings):
             return OperativeStackFrame(self.scope, self.parent, self.body, self.scope)
+        tree, form = self.bindings[self.index]
         if self.next_binding_value is self.__missing:
-            if rt.length(rt.first(self.bindings)) != 2:
-                return RuntimeErrorFrame(self.scope, self, "should be two elements in a let-binding", rt.first(self.bindings))
-            return DispatchStackFrame(self.scope, self, form=rt.second(rt.first(self.bindings)))
-        self.scope.add_match(rt, tree=rt.first(rt.first(self.bindings)), obj=self.next_binding_value)
-        return LetStackFrame(self.scope, self.parent, rt.rest(self.bindings), self.body)
+            if tree is None:
+                return RuntimeErrorFrame(self.scope, self, "should be two elements in a let-binding", form)
+            return DispatchStackFrame(self.scope, self, form=form)
+        self.scope.add_match(rt, tree=tree, obj=self.next_binding_value)
+        # each binding gets its own scope, so closures over earlier bindings don't see later ones
+        result = self.writable()
+        result.scope = self.scope.child_scope()
+        result.index = self.index + 1
+        result.next_binding_value = self.__missing
+        return result
 
     def __str__(self):
-        return "{} bindings={} body={}".format(self.__class__.__name__, self.bindings, self.body)
+        return "{} bindings={} body={}".format(self.__class__.__name__, self.bindings[self.index:], self.body)
 
 
 class TopLevelReturnValue:
@@ -192,14 +244,25 @@ class ApplicativeStackFrame(StackFrame):
         self.arg_values = []
 
     def with_value(self, rt, value):
-        result = ApplicativeStackFrame(self.scope, self.parent, self.func_value, self.remaining_args)
-        result.arg_values = self.arg_values + [value]
+        result = self.writable()
+        result.arg_values.append(value)
+        return result
+
+    def copy(self):
+        result = super(ApplicativeStackFrame, self).copy()
+        result.arg_values = list(self.arg_values)
         return result
 
     def frame_or_value(self, rt):
         if rt.is_null(self.remaining_args):
             args = rt.forms_to_list(self.arg_values)
             func = rt.unwrap(self.func_value)
+            if rt.is_delimited_continuation(func):
+                # composable: the captured frames return to this call, not to where they came from
+                result = reinstate(rt, rt.continuation_frame(func), self.parent)
+                for v in self.arg_values:
+                    result = result.with_value(rt, v)
+                return result
             if rt.is_continuation(func):
                 # is this correct? and/or the best way to do this?
                 result = rt.continuation_frame(func)
@@ -212,11 +275,17 @@ class ApplicativeStackFrame(StackFrame):
                 return result
             if rt.is_primitive_function(func):
                 return rt.apply_primitive_function(func, args, self.scope)
+            if rt.is_special_form(func):
+                # a wrapped special form: its operands are the argument values
+                result = DispatchStackFrame(self.scope, self.parent, rt.cons(func, args))
+                result.head = func
+                return result
             return make_operative_stack_frame(rt, self.scope, self.parent, func, args)
 
-        eval_rest = ApplicativeStackFrame(self.scope, self.parent, self.func_value, rt.rest(self.remaining_args))
-        eval_rest.arg_values = self.arg_values
-        return DispatchStackFrame(self.scope, eval_rest, rt.first(self.remaining_args))
+        form = rt.first(self.remaining_args)
+        eval_rest = self.writable()
+        eval_rest.remaining_args = rt.rest(self.remaining_args)
+        return DispatchStackFrame(self.scope, eval_rest, form)
 
     def __str__(self):
         return "{} func_value={}".format(self.__class__.__name__, self.func_value)
@@ -225,36 +294,117 @@ def make_operative_stack_frame(rt, scope, parent, func, args):
     operative_env = rt.operative_static_env(func).child_scope()
     operative_env.add_match(rt, tree=rt.operative_parameters(func), obj=args)
     operative_env.add_match(rt, tree=rt.operative_dynamic_env_parameter(func), obj=scope)
-    return OperativeStackFrame(scope, parent, rt.operative_body(func), operative_env)
+    return OperativeStackFrame(scope, parent, rt.operative_body(func), operative_env, func)
 
 
 class OperativeStackFrame(StackFrame):
     __missing = object()
 
-    def __init__(self, scope, parent, operative_body, operative_env):
+    def __init__(self, scope, parent, operative_body, operative_env, combiner=None):
+        """
+        :param combiner: The operative being called, if this is a call and not
+            e.g. the body of a let
+        """
         super(OperativeStackFrame, self).__init__(scope, parent)
         self.operative_body = operative_body
         self.operative_env = operative_env
+        self.combiner = combiner
         self.result_value = self.__missing
 
     def with_value(self, rt, value):
-        result = OperativeStackFrame(self.scope, self.parent, self.operative_body, self.operative_env)
+        result = self.writable()
         result.result_value = value
         return result
 
+    def is_waiting_for_last_form(self, rt):
+        return rt.is_null(self.operative_body)
+
     def frame_or_value(self, rt):
         if rt.is_null(self.operative_body):
             if self.result_value is self.__missing:
+                # the last form had no value, e.g. it was a define
                 return rt.IGNORE
             return self.result_value
-        eval_rest = OperativeStackFrame(self.scope, self.parent, rt.rest(self.operative_body), self.operative_env)
-        eval_rest.result_value = self.result_value
-        return DispatchStackFrame(self.operative_env, eval_rest, rt.first(self.operative_body))
+        form = rt.first(self.operative_body)
+        rest = rt.rest(self.operative_body)
+        if rt.is_null(rest) and isinstance(self.parent, OperativeStackFrame) and self.parent.is_waiting_for_last_form(rt):
+            # A tail call from the last form of another body, whose frame can
+            # take this form's value as its own: this frame isn't needed any more
+            return DispatchStackFrame(self.operative_env, self.parent, form)
+        env = self.operative_env
+        eval_rest = self.writable()
+        eval_rest.operative_body = rest
+        # only the last form's value counts
+        eval_rest.result_value = self.__missing
+        if rt.is_null(rest):
+            # Nothing is left to run in the environment, so don't keep what's
+            # bound in it alive, e.g. the head of a lazy sequence that a chain
+            # of tail calls is walking
+            eval_rest.operative_env = None
+        return DispatchStackFrame(env, eval_rest, form)
 
     def __str__(self):
         return "{} operative_body={}".format(self.__class__.__name__, self.operative_body)
 
 
+class IfStackFrame(StackFrame):
+    __missing = object()
+
+    def __init__(self, scope, parent, predicate, consequent, alternative):
+        super(IfStackFrame, self).__init__(scope, parent)
+        self.predicate = predicate
+        self.consequent = consequent
+        self.alternative = alternative
+        self.predicate_value = self.__missing
+
+    def with_value(self, rt, value):
+        if self.predicate_value is self.__missing:
+            result = self.writable()
+            result.predicate_value = value
+            return result
+        return RuntimeErrorFrame(self.scope, self, "with_value called too many times")
+
+    def frame_or_value(self, rt):
+        if self.predicate_value is self.__missing:
+            return DispatchStackFrame(self.scope, self, self.predicate)
+        if rt.is_truthy(self.predicate_value):
+            return DispatchStackFrame(self.scope, self.parent, self.consequent)
+        return DispatchStackFrame(self.scope, self.parent, self.alternative)
+
+    def __str__(self):
+        return "{} predicate={}".format(self.__class__.__name__, self.predicate)
+
+
+class AndStackFrame(StackFrame):
+    __missing = object()
+
+    def __init__(self, scope, parent, forms):
+        super(AndStackFrame, self).__init__(scope, parent)
+        self.forms = forms
+        self.last_value = self.__missing
+
+    def with_value(self, rt, value):
+        result = self.writable()
+        result.last_value = value
+        return result
+
+    def frame_or_value(self, rt):
+        if self.last_value is not self.__missing and not rt.is_truthy(self.last_value):
+            return rt.null()
+        if rt.is_null(self.forms):
+            return rt.true()
+        form = rt.first(self.forms)
+        if rt.is_null(rt.rest(self.forms)):
+            return DispatchStackFrame(self.scope, self.parent, form)
+        eval_rest = self.writable()
+        eval_rest.forms = rt.rest(self.forms)
+        eval_rest.last_value = self.__missing
+        return DispatchStackFrame(self.scope, eval_rest, form)
+
+    def __str__(self):
+        return "{} forms={}".format(self.__class__.__name__, self.forms)
+
+
 class CallCCStackFrame(StackFrame):
     __missing = object()
 
@@ -265,7 +415,7 @@ class CallCCStackFrame(StackFrame):
 
     def with_value(self, rt, value):
         if self.form_value is self.__missing:
-            result = CallCCStackFrame(self.scope, self.parent, self.form)
+            result = self.writable()
             result.form_value = value
             return result
         return RuntimeErrorFrame(self.scope, self, "with_value called too many times")
@@ -274,6 +424,7 @@ class CallCCStackFrame(StackFrame):
         if self.form_value is self.__missing:
             return DispatchStackFrame(self.scope, self, self.form)
         # invoke self.form_value with one argument, the continuation
+        share(self.parent)
         args = rt.cons(rt.continuation(self.parent), rt.null())
         result = DispatchStackFrame(self.scope, self.parent, rt.cons(self.form_value, args))
         result.head = self.form_value  # skip the "recur to get the first value" part
@@ -283,6 +434,104 @@ class CallCCStackFrame(StackFrame):
         return "{} form={}".format(self.__class__.__name__, self.form)
 
 
+class ResetStackFrame(StackFrame):
+    """
+    Delimits the continuations `shift` captures inside `form`, and passes on
+    the value of `form` (or of the body of a `shift` inside it).
+    """
+    __missing = object()
+
+    def __init__(self, scope, parent, form, value=__missing):
+        super(ResetStackFrame, self).__init__(scope, parent)
+        self.form = form
+        self.value = value
+
+    def with_value(self, rt, value):
+        result = self.writable()
+        result.value = value
+        return result
+
+    def frame_or_value(self, rt):
+        if self.value is self.__missing:
+            return DispatchStackFrame(self.scope, self, self.form)
+        return self.value
+
+    def __str__(self):
+        return "{} form={}".format(self.__class__.__name__, self.form)
+
+
+class ShiftStackFrame(StackFrame):
+    __missing = object()
+
+    def __init__(self, scope, parent, form):
+        super(ShiftStackFrame, self).__init__(scope, parent)
+        self.form = form
+        self.form_value = self.__missing
+
+    def with_value(self, rt, value):
+        if self.form_value is self.__missing:
+            result = self.writable()
+            result.form_value = value
+            return result
+        return RuntimeErrorFrame(self.scope, self, "with_value called too many times")
+
+    def frame_or_value(self, rt):
+        if self.form_value is self.__missing:
+            return DispatchStackFrame(self.scope, self, self.form)
+        delimiter = self.parent
+        while delimiter is not None and not isinstance(delimiter, ResetStackFrame):
+            delimiter = delimiter.parent
+        if delimiter is None:
+            return RuntimeErrorFrame(self.scope, self.parent, "shift outside of any reset", self.form)
+        # invoke self.form_value with the continuation up to the reset, in place of everything up to the reset
+        args = rt.cons(rt.delimited_continuation(capture(self.parent, delimiter)), rt.null())
+        result = DispatchStackFrame(self.scope, delimiter, rt.cons(self.form_value, args))
+        result.head = self.form_value
+        return result
+
+    def __str__(self):
+        return "{} form={}".format(self.__class__.__name__, self.form)
+
+
+def capture(frame, delimiter):
+    """
+    :return: A copy of the frames from `frame` up to but not including
+        `delimiter`, with the outermost one's parent None, or None if there
+        are no frames in between. The copies are shared, like the frames of a
+        call/cc continuation.
+    """
+    frames = []
+    while frame is not delimiter:
+        frames.append(frame)
+        frame = frame.parent
+    result = None
+    for frame in reversed(frames):
+        copied = frame.copy()
+        copied.parent = result
+        copied.shared = True
+        result = copied
+    return result
+
+
+def reinstate(rt, frame, parent):
+    """
+    :param frame: The innermost frame of a DelimitedContinuation
+    :return: The frame to give the continuation's argument to: a copy of the
+        continuation's frames under a new reset whose parent is `parent`
+    """
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.parent
+    scope = frames[-1].scope if frames else None
+    result = ResetStackFrame(scope, parent, rt.IGNORE, value=rt.IGNORE)
+    for frame in reversed(frames):
+        copied = frame.copy()
+        copied.parent = result
+        result = copied
+    return result
+
+
 class DispatchStackFrame(StackFrame):
     __missing = object()
 
@@ -293,7 +542,7 @@ class DispatchStackFrame(StackFrame):
 
     def with_value(self, rt, value):
         if self.head is self.__missing:
-            result = DispatchStackFrame(self.scope, self.parent, form=self.form)
+            result = self.writable()
             result.head = value
             return result
         return RuntimeErrorFrame(self.scope, self.parent, "with_value called too many times")
@@ -313,50 +562,10 @@ class DispatchStackFrame(StackFrame):
             # recur to get the first value
             return DispatchStackFrame(self.scope, self, form=rt.first(self.form))
 
-        if self.head is rt.IGNORE:
-            return rt.IGNORE
-        if self.head is rt.NS:
-            rt.set_current_ns(rt.second(self.form))
-            self.scope.set_ns(rt.current_ns())
-            return rt.IGNORE
-        if self.head is rt.REQUIRE:
-            rt.require_ns(rt.second(self.form))
-            return rt.IGNORE
-        if self.head is rt.LOAD:
-            rt.load_file(rt.second(self.form))
-            return rt.IGNORE
-        if self.head is rt.QUOTE:
-            return rt.second(self.form)
-        if self.head is rt.FEXPR:
-            # (fexpr (x y z) (...))
-            # from the Kernel concept "vau"
-            parameters = rt.second(self.form)
-            env_formal = rt.third(self.form)
-            body = rt.rest(rt.rest(rt.rest(self.form)))
-            return rt.operative(parameters, env_formal, body, self.scope.child_scope())
-
-        if self.head is rt.LABEL:
-            if rt.length(self.form) != 3:
-                return RuntimeErrorFrame(self.scope, self.parent, "wrong arguments to label", self.form)
-            return LabelStackFrame(self.scope, self.parent, label=rt.second(self.form), form=rt.third(self.form))
-
-        if self.head is rt.CALL_CC:
-            if rt.length(self.form) != 2:
-                return RuntimeErrorFrame(self.scope, self.parent, "wrong arguments to call/cc", self.form)
-            return CallCCStackFrame(self.scope, self.parent, form=rt.second(self.form))
-
-        if self.head is rt.COND:
-            return CondStackFrame(self.scope, self.parent, branches=rt.rest(self.form))
-        if self.head is rt.LET:
-            return LetStackFrame(self.scope, self.parent, bindings=rt.second(self.form), body=rt.rest(rt.rest(self.form)))
-        if self.head is rt.EVAL:
-            if rt.length(self.form) not in (2, 3):
-                return RuntimeErrorFrame(self.scope, self.parent, "wrong arguments to eval", self.form)
-            return EvalStackFrame(self.scope, self.parent, formlist=rt.rest(self.form))
-        if self.head is rt.DEFINE or self.head is rt.SET:
-            if rt.length(self.form) != 3:
-                return RuntimeErrorFrame(self.scope, self.parent, "wrong arguments to {}".format(self.head.name))
-            return DefineStackFrame(self.scope, self.parent, head=self.head, tree=rt.second(self.form), form=rt.third(self.form))
+        if rt.is_special_form(self.head):
+            handler = rt.SPECIAL_FORM_HANDLERS.get(self.head)
+            if handler is not None:
+                return handler(rt, self)
         if rt.is_applicative(self.head):
             args = rt.rest(self.form)
             return ApplicativeStackFrame(self.scope, self.parent, func_value=self.head, args=args)
@@ -369,6 +578,214 @@ class DispatchStackFrame(StackFrame):
         return "{} form={}".format(self.__class__.__name__, self.form)
 
 
+# What we know about the shape of forms we've dispatched, so that e.g. a cond's
+# branches are checked once rather than every time it's evaluated. Keyed by
+# id(form): entries hold on to their form, so its id can't be reused while they
+# exist. Forms built at run time and passed to `eval` would make this grow without
+# bound, so it's simply emptied when it fills up.
+_FORM_INFO = {}
+FORM_INFO_LIMIT = 1 << 14
+
+
+def form_info(rt, form, analyze):
+    """
+    :param analyze: func(rt, form) -> info
+    :return: analyze(rt, form), computed once per form
+    """
+    entry = _FORM_INFO.get(id(form))
+    if entry is not None and entry[0] is form and entry[1] is analyze:
+        return entry[2]
+    info = analyze(rt, form)
+    if len(_FORM_INFO) >= FORM_INFO_LIMIT:
+        _FORM_INFO.clear()
+    _FORM_INFO[id(form)] = (form, analyze, info)
+    return info
+
+
+def form_length(rt, form):
+    return rt.length(form)
+
+
+def cond_branches(rt, form):
+    """
+    :return: Tuple of (predicate, consequent) for each branch of a cond, or
+        (None, branch) for a branch that isn't a pair
+    """
+    result = []
+    for branch in rt.iter_elements(rt.rest(form)):
+        if rt.length(branch) != 2:
+            result.append((None, branch))
+        else:
+            result.append((rt.first(branch), rt.second(branch)))
+    return tuple(result)
+
+
+def let_bindings(rt, form):
+    """
+    :return: Tuple of (tree, form) for each binding of a let, or (None, binding)
+        for a binding that isn't a pair
+    """
+    result = []
+    for binding in rt.iter_elements(rt.second(form)):
+        if rt.length(binding) != 2:
+            result.append((None, binding))
+        else:
+            result.append((rt.first(binding), rt.second(binding)))
+    return tuple(result)
+
+
+# Special form handlers, registered in rt.SPECIAL_FORM_HANDLERS. Each takes the
+# DispatchStackFrame whose head evaluated to the special form and returns a value
+# or the frame it becomes.
+
+def dispatch_ignore(rt, frame):
+    return rt.IGNORE
+
+
+def dispatch_ns(rt, frame):
+    rt.set_current_ns(rt.second(frame.form))
+    frame.scope.set_ns(rt.current_ns())
+    return rt.IGNORE
+
+
+def dispatch_require(rt, frame):
+    rt.require_ns(rt.second(frame.form))
+    return rt.IGNORE
+
+
+def dispatch_load(rt, frame):
+    rt.load_file(rt.second(frame.form))
+    return rt.IGNORE
+
+
+def dispatch_quote(rt, frame):
+    return rt.second(frame.form)
+
+
+def dispatch_fexpr(rt, frame):
+    # (fexpr (x y z) (...))
+    # from the Kernel concept "vau"
+    parameters = rt.second(frame.form)
+    env_formal = rt.third(frame.form)
+    body = rt.rest(rt.rest(rt.rest(frame.form)))
+    return rt.operative(parameters, env_formal, body, frame.scope.child_scope())
+
+
+def dispatch_label(rt, frame):
+    if form_info(rt, frame.form, form_length) != 3:
+        return RuntimeErrorFrame(frame.scope, frame.parent, "wrong arguments to label", frame.form)
+    return LabelStackFrame(frame.scope, frame.parent, label=rt.second(frame.form), form=rt.third(frame.form))
+
+
+def dispatch_call_cc(rt, frame):
+    if form_info(rt, frame.form, form_length) != 2:
+        return RuntimeErrorFrame(frame.scope, frame.parent, "wrong arguments to call/cc", frame.form)
+    return CallCCStackFrame(frame.scope, frame.parent, form=rt.second(frame.form))
+
+
+def dispatch_reset(rt, frame):
+    if form_info(rt, frame.form, form_length) != 2:
+        return RuntimeErrorFrame(frame.scope, frame.parent, "wrong arguments to reset", frame.form)
+    return ResetStackFrame(frame.scope, frame.parent, form=rt.second(frame.form))
+
+
+def dispatch_shift(rt, frame):
+    if form_info(rt, frame.form, form_length) != 2:
+        return RuntimeErrorFrame(frame.scope, frame.parent, "wrong arguments to shift", frame.form)
+    return ShiftStackFrame(frame.scope, frame.parent, form=rt.second(frame.form))
+
+
+def dispatch_delay(rt, frame):
+    if form_info(rt, frame.form, form_length) != 2:
+        return RuntimeErrorFrame(frame.scope, frame.parent, "wrong arguments to delay", frame.form)
+    scope = frame.scope
+    form = rt.second(frame.form)
+    # forced from primitives as well as from code, so it gets a run of its own
+    return rt.promise(lambda: run(rt, DispatchStackFrame(scope, None, form), form))
+
+
+def dispatch_cond(rt, frame):
+    return CondStackFrame(frame.scope, frame.parent, branches=form_info(rt, frame.form, cond_branches))
+
+
+def dispatch_let(rt, frame):
+    bindings = form_info(rt, frame.form, let_bindings)
+    return LetStackFrame(frame.scope, frame.parent, bindings=bindings, body=rt.rest(rt.rest(frame.form)))
+
+
+def dispatch_eval(rt, frame):
+    if form_info(rt, frame.form, form_length) not in (2, 3):
+        return RuntimeErrorFrame(frame.scope, frame.parent, "wrong arguments to eval", frame.form)
+    return EvalStackFrame(frame.scope, frame.parent, formlist=rt.rest(frame.form))
+
+
+def dispatch_define(rt, frame):
+    """
+    Handles both `define` and `set!`.
+    """
+    if form_info(rt, frame.form, form_length) != 3:
+        return RuntimeErrorFrame(frame.scope, frame.parent, "wrong arguments to {}".format(frame.head.name))
+    return DefineStackFrame(frame.scope, frame.parent, head=frame.head, tree=rt.second(frame.form), form=rt.third(frame.form))
+
+
+# Native versions of combiners that lib/core_pure.sgml defines as fexprs
+
+def dispatch_lambda(rt, frame):
+    # (lambda formals . body) is (wrap (fexpr formals _ . body))
+    if rt.is_atom(rt.rest(frame.form)):
+        return RuntimeErrorFrame(frame.scope, frame.parent, "wrong arguments to lambda", frame.form)
+    formals = rt.second(frame.form)
+    body = rt.rest(rt.rest(frame.form))
+    return rt.wrap(rt.operative(formals, rt.IGNORE, body, frame.scope.child_scope()))
+
+
+def dispatch_defn(rt, frame):
+    if form_info(rt, frame.form, form_length) < 3:
+        return RuntimeErrorFrame(frame.scope, frame.parent, "wrong arguments to defn", frame.form)
+    name = rt.second(frame.form)
+    formals = rt.third(frame.form)
+    body = rt.rest(rt.rest(rt.rest(frame.form)))
+    value = rt.wrap(rt.operative(formals, rt.IGNORE, body, frame.scope.child_scope()))
+    frame.scope.ns_define_match(rt, tree=name, obj=value)
+    return rt.IGNORE
+
+
+def dispatch_if(rt, frame):
+    if form_info(rt, frame.form, form_length) != 4:
+        return RuntimeErrorFrame(frame.scope, frame.parent, "wrong arguments to if", frame.form)
+    return IfStackFrame(
+        frame.scope,
+        frame.parent,
+        predicate=rt.second(frame.form),
+        consequent=rt.third(frame.form),
+        alternative=rt.fourth(frame.form),
+    )
+
+
+def dispatch_and(rt, frame):
+    return AndStackFrame(frame.scope, frame.parent, forms=rt.rest(frame.form))
+
+
+def dispatch_begin(rt, frame):
+    return OperativeStackFrame(frame.scope, frame.parent, rt.rest(frame.form), frame.scope)
+
+
+def dispatch_apply(rt, frame):
+    """
+    (apply appv args [env]), bound wrapped, so the operands are already values.
+    Evaluates (unwrap(appv) . args) in env, or in a fresh environment.
+    """
+    # built afresh for each call, so not worth a form_info() entry
+    length = rt.length(frame.form)
+    if length not in (3, 4):
+        return RuntimeErrorFrame(frame.scope, frame.parent, "wrong arguments to apply", frame.form)
+    func = rt.unwrap(rt.second(frame.form))
+    scope = rt.fourth(frame.form) if length == 4 else rt.fresh_scope()
+    result = DispatchStackFrame(scope, frame.parent, rt.cons(func, rt.third(frame.form)))
+    result.head = func
+    return result
+
+
 def stacktrace(stack_frame):
     trace = []
     while stack_frame is not None:
@@ -384,31 +801,149 @@ def macroexpand(rt, code):
     return macroexpand(rt, expanded)
 
 
+# Trampoline steps taken by every run() so far, for sgml.bench
+step_count = 0
+
+
+# A sgml.interpreter.profile.Profiler to run evaluate()'s code under instead of run()
+profiler = None
+
+
 def evaluate(rt, code):
     stack_top = DispatchStackFrame(rt.current_ns().scope(), parent=None, form=code)
-    while True:
-        try:
-            frame_or_value = stack_top.frame_or_value(rt)
+    if profiler is not None:
+        return profiler.run(rt, stack_top, code)
+    if _hooks:
+        return run_with_hooks(rt, stack_top, code)
+    return run(rt, stack_top, code)
+
+
+def run(rt, stack_top, code):
+    """
+    Drive the trampoline from `stack_top` until a value reaches the root frame
+    (the one with parent=None) and return that value.
+
+    :param code: The form being evaluated, for error messages
+    """
+    global step_count
+    steps = 0
+    try:
+        while True:
+            steps += 1
+            try:
+                frame_or_value = stack_top.frame_or_value(rt)
+                if isinstance(frame_or_value, StackFrame):
+                    # "push"
+                    stack_top = frame_or_value
+                elif stack_top.parent is None:
+                    return frame_or_value
+                elif isinstance(frame_or_value, TopLevelReturnValue):
+                    return frame_or_value.value
+                else:
+                    # "pop"
+                    stack_top = stack_top.parent.with_value(rt, frame_or_value)
+            except Exception as e:
+                #stack_top = RuntimeErrorFrame(scope, stack_top, "Python error", e)
+                raise
+
+            if isinstance(stack_top, RuntimeErrorFrame):
+                raise_runtime_error(rt, stack_top, code)
+    finally:
+        step_count += steps
+
+
+# What evaluate() can call hooks on, and the arguments each is called with:
+#   push(rt, frame): `frame` is now the top of the stack
+#   pop(rt, frame, value): `frame` returned `value` to its parent
+#   primitive(rt, function, arguments): a PrimitiveFunction is about to be called
+#   enter(rt, frame): an OperativeStackFrame for a call to frame.combiner was pushed
+#   exit(rt, frame, value): that frame returned `value`. A tail call's frame is
+#       gone by the time it returns, so it exits with its caller's.
+#   error(rt, frame, exception): evaluation is failing at `frame` with `exception`
+HOOK_EVENTS = ("push", "pop", "primitive", "enter", "exit", "error")
+
+# event -> [callback]; only events with callbacks have entries
+_hooks = {}
+
+
+def add_hook(event, callback):
+    """
+    Call `callback` on `event` (one of HOOK_EVENTS) in code evaluate() runs from
+    now on (not sgml.interpreter.compiler's, which doesn't use frames). While
+    there are no hooks, evaluate() runs code with run(), which doesn't check for any.
+    """
+    if event not in HOOK_EVENTS:
+        raise ValueError("Unknown event {}".format(event))
+    _hooks.setdefault(event, []).append(callback)
+
+
+def remove_hook(event, callback):
+    callbacks = _hooks.get(event, [])
+    if callback in callbacks:
+        callbacks.remove(callback)
+    if not callbacks:
+        _hooks.pop(event, None)
+
+
+def _call_hooks(event, *args):
+    for callback in _hooks.get(event, ()):
+        callback(*args)
+
+
+def run_with_hooks(rt, stack_top, code):
+    """
+    run(), calling the hooks registered with add_hook along the way.
+    """
+    global step_count
+    steps = 0
+    try:
+        while True:
+            steps += 1
+            current = stack_top
+            if isinstance(current, ApplicativeStackFrame) and rt.is_null(current.remaining_args):
+                func = rt.unwrap(current.func_value)
+                if rt.is_primitive_function(func):
+                    _call_hooks("primitive", rt, func, rt.forms_to_list(current.arg_values))
+            frame_or_value = current.frame_or_value(rt)
             if isinstance(frame_or_value, StackFrame):
                 # "push"
                 stack_top = frame_or_value
-            elif stack_top.parent is None:
-                return frame_or_value
-            elif isinstance(frame_or_value, TopLevelReturnValue):
-                return frame_or_value.value
-            else:
-                # "pop"
-                stack_top = stack_top.parent.with_value(rt, frame_or_value)
-        except Exception as e:
-            #stack_top = RuntimeErrorFrame(scope, stack_top, "Python error", e)
-            raise
-
-        if isinstance(stack_top, RuntimeErrorFrame):
-            # todo: try/catch
-            if _print_stack_trace:
-                print("Stack:", file=sys.stderr)
-                for frame in stacktrace(stack_top):
-                    print("    {}".format(frame), file=sys.stderr)
-                if stack_top.has_detail():
-                    print("Details:", rt.as_string(stack_top.detail), file=sys.stderr)
-            raise RuntimeError("Exception evaluating {}: {}".format(rt.as_string(code), stack_top))
+                _call_hooks("push", rt, stack_top)
+                if (
+                        isinstance(stack_top, OperativeStackFrame)
+                        and stack_top.combiner is not None
+                        and stack_top.operative_body is rt.operative_body(stack_top.combiner)
+                ):
+                    _call_hooks("enter", rt, stack_top)
+                if isinstance(stack_top, RuntimeErrorFrame):
+                    raise_runtime_error(rt, stack_top, code)
+                continue
+
+            value = frame_or_value
+            if current.parent is not None and isinstance(frame_or_value, TopLevelReturnValue):
+                value = frame_or_value.value
+            _call_hooks("pop", rt, current, value)
+            if isinstance(current, OperativeStackFrame) and current.combiner is not None:
+                _call_hooks("exit", rt, current, value)
+            if current.parent is None or value is not frame_or_value:
+                return value
+            # "pop"
+            stack_top = current.parent.with_value(rt, frame_or_value)
+            if isinstance(stack_top, RuntimeErrorFrame):
+                raise_runtime_error(rt, stack_top, code)
+    except Exception as e:
+        _call_hooks("error", rt, stack_top, e)
+        raise
+    finally:
+        step_count += steps
+
+
+def raise_runtime_error(rt, error_frame, code):
+    # todo: try/catch
+    if _print_stack_trace:
+        print("Stack:", file=sys.stderr)
+        for frame in stacktrace(error_frame):
+            print("    {}".format(frame), file=sys.stderr)
+        if error_frame.has_detail():
+            print("Details:", rt.as_string(error_frame.detail), file=sys.stderr)
+    raise RuntimeError("Exception evaluating {}: {}".format(rt.as_string(code), error_frame))
@@ -0,0 +1,604 @@
+"""
+Closure compiler: an opt-in alternative to the stack frame trampoline.
+
+Each form is analyzed once into a tree of Python closures, `node(scope) -> value`,
+which is then run directly instead of being re-dispatched a frame at a time.
+Combinations are compiled lazily: the head is compiled up front, and the operands
+are compiled the first time we learn whether the head is a special form, an
+applicative (operands are expressions) or an operative (operands are data).
+
+Scopes created by compiled code are LexicalScopes. Compilation carries a context,
+the layouts of the scopes enclosing the form innermost first, so a variable
+reference resolves to a (depth, slot) pair where it can. The context ends wherever
+the compiler stops knowing what the scope chain looks like, e.g. at the top of an
+`eval`'d form; from there on lookups go through Scope.get.
+
+The frame machine is still used where its reified stack matters:
+  - code that mentions `call/cc` runs entirely in frames, whether it's a top-level
+    form, an operative body or an `eval`'d form;
+  - special forms that have no compiler here are dispatched to a one-off frame;
+  - operative calls nested deeper than MAX_DEPTH continue in frames, so deep
+    recursion is bounded by the heap rather than by the Python stack.
+Continuations captured in one of those frame runs are delimited by it: invoking one
+from compiled code resumes its frames and yields whatever value reaches their root.
+"""
+
+import sgml.interpreter
+from sgml.environment import LexicalScope, UNBOUND
+from sgml.thunk import Applicative, Continuation, Operative, PrimitiveFunction
+
+MAX_DEPTH = 64
+
+_FRAME_ONLY_SYMBOLS = frozenset(["call/cc", "reset", "shift"])
+
+# Forms whose operands aren't evaluated in the current scope, so a `label` inside
+# one doesn't bind anything here
+_OPAQUE_SYMBOLS = frozenset(["quote", "fexpr", "lambda", "defn", "let"])
+
+# What `define` and `set!` produce: no value at all. Argument lists skip it, like
+# DefineStackFrame handing control straight back to its parent, and a sequence
+# ending in it has the value _.
+_VOID = object()
+
+_depth = 0
+
+
+def evaluate(rt, code):
+    if _needs_frames(rt, code):
+        return sgml.interpreter.evaluate(rt, code)
+    result = compile_form(rt, code, ())(rt.current_ns().scope())
+    return None if result is _VOID else result
+
+
+def compile_form(rt, form, context):
+    """
+    :param context: Tuple of the layouts of the enclosing LexicalScopes, innermost
+        first
+    :return: func(scope) -> value
+    """
+    if rt.is_symbol(form):
+        return _compile_symbol(rt, form, context)
+    if rt.is_atom(form):
+        return lambda scope: form
+    return _compile_combination(rt, form, context)
+
+
+def _compile_symbol(rt, symbol, context):
+    for depth, layout in enumerate(context):
+        if symbol in layout:
+            return _compile_lexical_reference(rt, symbol, depth, layout[symbol])
+    return _compile_free_reference(rt, symbol, len(context))
+
+
+def _compile_lexical_reference(rt, symbol, depth, slot):
+    if depth == 0:
+        def run_local(scope):
+            value = scope.values[slot]
+            if value is UNBOUND:
+                return scope.get(rt, symbol)
+            return value
+        return run_local
+
+    def run(scope):
+        s = scope
+        for _ in range(depth):
+            if s.env:
+                # something bound a name we didn't foresee, which may shadow this one
+                return scope.get(rt, symbol)
+            s = s.parent
+        value = s.values[slot]
+        if value is UNBOUND:
+            return scope.get(rt, symbol)
+        return value
+    return run
+
+
+def _compile_free_reference(rt, symbol, depth):
+    if depth == 0:
+        return lambda scope: scope.get(rt, symbol)
+
+    def run(scope):
+        s = scope
+        for _ in range(depth):
+            if s.env:
+                return scope.get(rt, symbol)
+            s = s.parent
+        return s.get(rt, symbol)
+    return run
+
+
+def _compile_combination(rt, form, context):
+    head = compile_form(rt, rt.first(form), context)
+    operands = rt.rest(form)
+    arguments = None
+    special_forms = {}
+
+    def run(scope):
+        nonlocal arguments
+        combiner = head(scope)
+        if isinstance(combiner, (Applicative, PrimitiveFunction, Continuation)):
+            if arguments is None:
+                arguments = [compile_form(rt, f, context) for f in rt.iter_elements(operands)]
+            values = []
+            for argument in arguments:
+                value = argument(scope)
+                if value is not _VOID:
+                    values.append(value)
+            return apply_applicative(rt, combiner, values, scope)
+        if isinstance(combiner, Operative):
+            return apply_operative(rt, combiner, operands, scope)
+        if isinstance(combiner, rt.SpecialForm):
+            node = special_forms.get(combiner)
+            if node is None:
+                node = special_forms[combiner] = _compile_special_form(rt, combiner, form, context)
+            return node(scope)
+        _error(rt, form, "non-applicable object")
+
+    return run
+
+
+def apply_applicative(rt, applicative, values, scope):
+    func = rt.unwrap(applicative)
+    if rt.is_primitive_function(func):
+        return rt.apply_primitive_function(func, rt.forms_to_list(values), scope)
+    if rt.is_continuation(func):
+        return _resume(rt, func, values)
+    if rt.is_special_form(func):
+        # a wrapped special form: its operands are the argument values
+        form = rt.cons(func, rt.forms_to_list(values))
+        return _compile_special_form(rt, func, form, ())(scope)
+    compiled = _compiled_body(rt, func)
+    if compiled.parameter_count is None or len(values) != compiled.parameter_count:
+        return apply_operative(rt, func, rt.forms_to_list(values), scope)
+    if compiled.run is _run_in_frames or _depth >= MAX_DEPTH:
+        return _apply_in_frames(rt, func, rt.forms_to_list(values), scope)
+    static_env = rt.operative_static_env(func)
+    if compiled.binds_env:
+        values.append(scope)
+    if compiled.unbound_slots:
+        values.extend([UNBOUND] * compiled.unbound_slots)
+    return _run_body(compiled, LexicalScope(compiled.layout, static_env, static_env.ns, values))
+
+
+def apply_operative(rt, operative, operands, scope):
+    compiled = _compiled_body(rt, operative)
+    if compiled.run is _run_in_frames or _depth >= MAX_DEPTH:
+        return _apply_in_frames(rt, operative, operands, scope)
+    static_env = rt.operative_static_env(operative)
+    env = LexicalScope(compiled.layout, static_env, static_env.ns)
+    env.add_match(rt, tree=rt.operative_parameters(operative), obj=operands)
+    env.add_match(rt, tree=rt.operative_dynamic_env_parameter(operative), obj=scope)
+    return _run_body(compiled, env)
+
+
+def _run_body(compiled, env):
+    global _depth
+    _depth += 1
+    try:
+        return compiled.run(env)
+    finally:
+        _depth -= 1
+
+
+def _apply_in_frames(rt, operative, operands, scope):
+    frame = sgml.interpreter.make_operative_stack_frame(rt, scope, None, operative, operands)
+    return sgml.interpreter.run(rt, frame, rt.operative_body(operative))
+
+
+class _CompiledBody:
+    """
+    An operative's body, and the layout of the scope it runs in: parameters first,
+    then the dynamic environment formal, then any names the body `label`s.
+
+    parameter_count is set when the parameters are a flat list of distinct
+    symbols, so that a list of argument values can become the scope's slots as is.
+    """
+    def __init__(self, rt, parameters, env_formal, body, context):
+        names = _tree_symbols(rt, parameters)
+        flat = _flat_parameter_names(rt, parameters)
+        self.parameter_count = None if flat is None else len(flat)
+        self.binds_env = False
+        if rt.is_symbol(env_formal) and env_formal.text != "_":
+            if env_formal in names:
+                self.parameter_count = None
+            else:
+                self.binds_env = True
+            names.append(env_formal)
+        names.extend(_label_symbols(rt, body))
+        self.layout = _layout(names)
+        self.unbound_slots = len(self.layout) - (self.parameter_count or 0) - self.binds_env
+        if _needs_frames(rt, body):
+            self.run = _run_in_frames
+        else:
+            self.run = _compile_sequence(rt, body, (self.layout,) + context)
+
+
+def _compiled_body(rt, operative):
+    compiled = operative.compiled
+    if compiled is None:
+        compiled = operative.compiled = _CompiledBody(
+            rt,
+            rt.operative_parameters(operative),
+            rt.operative_dynamic_env_parameter(operative),
+            rt.operative_body(operative),
+            (),
+        )
+    return compiled
+
+
+def _flat_parameter_names(rt, parameters):
+    names = []
+    while not rt.is_atom(parameters):
+        parameter = rt.first(parameters)
+        if not rt.is_symbol(parameter) or parameter.text == "_" or parameter in names:
+            return None
+        names.append(parameter)
+        parameters = rt.rest(parameters)
+    if not rt.is_null(parameters):
+        return None
+    return tuple(names)
+
+
+def _tree_symbols(rt, tree):
+    result = []
+    pending = [tree]
+    while pending:
+        tree = pending.pop()
+        if rt.is_symbol(tree):
+            result.append(tree)
+        elif not rt.is_atom(tree):
+            pending.append(rt.rest(tree))
+            pending.append(rt.first(tree))
+    return result
+
+
+def _label_symbols(rt, forms):
+    """
+    The names `label` forms among `forms` may bind in the scope they run in.
+    """
+    result = []
+    pending = [forms]
+    while pending:
+        form = pending.pop()
+        if rt.is_atom(form):
+            continue
+        head = rt.first(form)
+        if rt.is_symbol(head):
+            if head.text in _OPAQUE_SYMBOLS:
+                continue
+            if head.text == "label" and not rt.is_atom(rt.rest(form)):
+                result.extend(_tree_symbols(rt, rt.second(form)))
+        pending.append(rt.rest(form))
+        pending.append(head)
+    return result
+
+
+def _layout(symbols):
+    layout = {}
+    for symbol in symbols:
+        if symbol.text != "_" and symbol not in layout:
+            layout[symbol] = len(layout)
+    return layout
+
+
+def _resume(rt, continuation, values):
+    frame = rt.continuation_frame(continuation)
+    if rt.is_delimited_continuation(continuation):
+        frame = sgml.interpreter.reinstate(rt, frame, None)
+    if frame is None:
+        if len(values) != 1:
+            _error(rt, rt.forms_to_list(values), "top-level continuation should return one item")
+        return values[0]
+    for value in values:
+        frame = frame.with_value(rt, value)
+    return sgml.interpreter.run(rt, frame, rt.forms_to_list(values))
+
+
+def _run_in_frames(rt, form, scope):
+    return sgml.interpreter.run(rt, sgml.interpreter.DispatchStackFrame(scope, None, form), form)
+
+
+def _needs_frames(rt, form):
+    pending = [form]
+    while pending:
+        form = pending.pop()
+        if rt.is_symbol(form):
+            if form.text in _FRAME_ONLY_SYMBOLS:
+                return True
+        elif not rt.is_atom(form):
+            pending.append(rt.rest(form))
+            pending.append(rt.first(form))
+    return False
+
+
+def _compile_sequence(rt, forms, context):
+    nodes = [compile_form(rt, f, context) for f in rt.iter_elements(forms)]
+    ignore = rt.IGNORE
+    if len(nodes) == 1:
+        node = nodes[0]
+
+        def run_one(scope):
+            value = node(scope)
+            return ignore if value is _VOID else value
+        return run_one
+
+    def run(scope):
+        value = ignore
+        for n in nodes:
+            value = n(scope)
+        return ignore if value is _VOID else value
+
+    return run
+
+
+def _eval_in(rt, form, scope):
+    global _depth
+    if _needs_frames(rt, form):
+        return _run_in_frames(rt, form, scope)
+    node = compile_form(rt, form, ())
+    _depth += 1
+    try:
+        return node(scope)
+    finally:
+        _depth -= 1
+
+
+def _error(rt, form, message, *detail):
+    if detail:
+        message = "{}: {}".format(message, rt.as_string(detail[0]))
+    raise RuntimeError("Exception evaluating {}: {}".format(rt.as_string(form), message))
+
+
+def _error_node(rt, form, message, *detail):
+    def run(scope):
+        _error(rt, form, message, *detail)
+    return run
+
+
+def _compile_special_form(rt, head, form, context):
+    compiler = rt.SPECIAL_FORM_COMPILERS.get(head)
+    if compiler is None:
+        return _compile_in_frames(rt, head, form)
+    return compiler(rt, form, context)
+
+
+def _compile_in_frames(rt, head, form):
+    def run(scope):
+        frame = sgml.interpreter.DispatchStackFrame(scope, None, form)
+        frame.head = head
+        return sgml.interpreter.run(rt, frame, form)
+    return run
+
+
+def compile_ignore(rt, form, context):
+    ignore = rt.IGNORE
+    return lambda scope: ignore
+
+
+def compile_quote(rt, form, context):
+    value = rt.second(form)
+    return lambda scope: value
+
+
+def compile_delay(rt, form, context):
+    if rt.length(form) != 2:
+        return _error_node(rt, form, "wrong arguments to delay")
+    node = compile_form(rt, rt.second(form), context)
+
+    def force(scope):
+        global _depth
+        _depth += 1
+        try:
+            value = node(scope)
+        finally:
+            _depth -= 1
+        return rt.IGNORE if value is _VOID else value
+    return lambda scope: rt.promise(lambda: force(scope))
+
+
+def compile_ns(rt, form, context):
+    name = rt.second(form)
+
+    def run(scope):
+        rt.set_current_ns(name)
+        scope.set_ns(rt.current_ns())
+        return rt.IGNORE
+    return run
+
+
+def compile_require(rt, form, context):
+    name = rt.second(form)
+
+    def run(scope):
+        rt.require_ns(name)
+        return rt.IGNORE
+    return run
+
+
+def compile_load(rt, form, context):
+    path = rt.second(form)
+
+    def run(scope):
+        rt.load_file(path)
+        return rt.IGNORE
+    return run
+
+
+def compile_fexpr(rt, form, context):
+    return _compile_operative(rt, rt.second(form), rt.third(form), rt.rest(rt.rest(rt.rest(form))), context)
+
+
+def _compile_operative(rt, parameters, env_formal, body, context):
+    compiled = []
+
+    def run(scope):
+        # The frame machine closes over a fresh child of `scope`, but nothing can
+        # ever bind anything in it, so closing over `scope` itself is the same.
+        result = rt.operative(parameters, env_formal, body, scope)
+        if not compiled:
+            compiled.append(_CompiledBody(rt, parameters, env_formal, body, context))
+        result.compiled = compiled[0]
+        return result
+    return run
+
+
+def compile_label(rt, form, context):
+    if rt.length(form) != 3:
+        return _error_node(rt, form, "wrong arguments to label")
+    label = rt.second(form)
+    node = compile_form(rt, rt.third(form), context)
+
+    def run(scope):
+        value = node(scope)
+        if rt.is_symbol(label):
+            rt.name_combiner(value, label)
+        scope.add_match(rt, tree=label, obj=value)
+        return value
+    return run
+
+
+def compile_cond(rt, form, context):
+    branches = []
+    for branch in rt.iter_elements(rt.rest(form)):
+        if rt.length(branch) != 2:
+            branches.append((_error_node(rt, form, "should be two elements in a cond-pair", branch), None))
+            continue
+        branches.append((compile_form(rt, rt.first(branch), context), compile_form(rt, rt.second(branch), context)))
+
+    def run(scope):
+        for predicate, consequent in branches:
+            if predicate(scope) is not False:
+                return consequent(scope)
+        _error(rt, form, "no matches in cond")
+    return run
+
+
+def compile_let(rt, form, context):
+    # Like LetStackFrame, each binding gets a scope of its own, and the body one more
+    bindings = []
+    for binding in rt.iter_elements(rt.second(form)):
+        if rt.length(binding) != 2:
+            bindings.append(({}, None, _error_node(rt, form, "should be two elements in a let-binding", binding)))
+            continue
+        tree = rt.first(binding)
+        expression = rt.second(binding)
+        layout = _layout(_tree_symbols(rt, tree) + _label_symbols(rt, rt.cons(expression, rt.null())))
+        context = (layout,) + context
+        bindings.append((layout, tree, compile_form(rt, expression, context)))
+    body_forms = rt.rest(rt.rest(form))
+    body_layout = _layout(_label_symbols(rt, body_forms))
+    body = _compile_sequence(rt, body_forms, (body_layout,) + context)
+
+    def run(scope):
+        env = scope
+        for layout, tree, node in bindings:
+            env = LexicalScope(layout, env, env.ns)
+            env.add_match(rt, tree=tree, obj=node(env))
+        return body(LexicalScope(body_layout, env, env.ns))
+    return run
+
+
+def compile_eval(rt, form, context):
+    if rt.length(form) not in (2, 3):
+        return _error_node(rt, form, "wrong arguments to eval")
+    expression = compile_form(rt, rt.second(form), context)
+    env = compile_form(rt, rt.third(form), context) if rt.length(form) == 3 else None
+
+    def run(scope):
+        code = expression(scope)
+        target = rt.fresh_scope() if env is None else env(scope)
+        return _eval_in(rt, code, target)
+    return run
+
+
+def compile_define(rt, form, context):
+    if rt.length(form) != 3:
+        return _error_node(rt, form, "wrong arguments to define")
+    tree = rt.second(form)
+    node = compile_form(rt, rt.third(form), context)
+
+    def run(scope):
+        scope.ns_define_match(rt, tree=tree, obj=node(scope))
+        return _VOID
+    return run
+
+
+def compile_set(rt, form, context):
+    if rt.length(form) != 3:
+        return _error_node(rt, form, "wrong arguments to set!")
+    tree = rt.second(form)
+    node = compile_form(rt, rt.third(form), context)
+
+    def run(scope):
+        scope.ns_set_match(rt, tree=tree, obj=node(scope))
+        return _VOID
+    return run
+
+
+
+def compile_lambda(rt, form, context):
+    if rt.is_atom(rt.rest(form)):
+        return _error_node(rt, form, "wrong arguments to lambda")
+    operative = _compile_operative(rt, rt.second(form), rt.IGNORE, rt.rest(rt.rest(form)), context)
+    return lambda scope: rt.wrap(operative(scope))
+
+
+def compile_defn(rt, form, context):
+    if rt.length(form) < 3:
+        return _error_node(rt, form, "wrong arguments to defn")
+    name = rt.second(form)
+    operative = _compile_operative(rt, rt.third(form), rt.IGNORE, rt.rest(rt.rest(rt.rest(form))), context)
+
+    def run(scope):
+        scope.ns_define_match(rt, tree=name, obj=rt.wrap(operative(scope)))
+        return rt.IGNORE
+    return run
+
+
+def compile_if(rt, form, context):
+    if rt.length(form) != 4:
+        return _error_node(rt, form, "wrong arguments to if")
+    predicate = compile_form(rt, rt.second(form), context)
+    consequent = compile_form(rt, rt.third(form), context)
+    alternative = compile_form(rt, rt.fourth(form), context)
+
+    def run(scope):
+        if predicate(scope) is not False:
+            return consequent(scope)
+        return alternative(scope)
+    return run
+
+
+def compile_and(rt, form, context):
+    nodes = [compile_form(rt, f, context) for f in rt.iter_elements(rt.rest(form))]
+    if not nodes:
+        true = rt.true()
+        return lambda scope: true
+    last = nodes.pop()
+
+    def run(scope):
+        for node in nodes:
+            if node(scope) is False:
+                return rt.null()
+        return last(scope)
+    return run
+
+
+def compile_begin(rt, form, context):
+    return _compile_sequence(rt, rt.rest(form), context)
+
+
+def compile_apply(rt, form, context):
+    # apply is bound wrapped, so the operands are already values
+    if rt.length(form) not in (3, 4):
+        return _error_node(rt, form, "wrong arguments to apply")
+    func = rt.unwrap(rt.second(form))
+    arguments = rt.third(form)
+    env = rt.fourth(form) if rt.length(form) == 4 else None
+
+    def run(scope):
+        target = rt.fresh_scope() if env is None else env
+        if isinstance(func, Operative):
+            return apply_operative(rt, func, arguments, target)
+        return _eval_in(rt, rt.cons(func, arguments), target)
+    return run
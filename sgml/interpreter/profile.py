@@ -0,0 +1,134 @@
+"""
+A deterministic profiler for sgml code: while sgml.interpreter.profiler is set,
+evaluate() runs code under Profiler.run instead of sgml.interpreter.run, which
+charges every step of the trampoline, and the wall time it took, to the sgml
+functions on the stack at the time.
+
+Functions are the operatives called by OperativeStackFrames, named by the
+define, defn or label that first bound them (see sgml.rt.name_combiner). A
+function's exclusive totals are the steps taken with it on top of the stack,
+and its inclusive totals those taken with it anywhere on the stack. Because tail
+calls don't keep their caller's frame, a tail call's steps are charged as if the
+caller had made it from wherever it was itself called.
+"""
+import sys
+import time
+
+import sgml.interpreter
+from sgml.interpreter import OperativeStackFrame, RuntimeErrorFrame, StackFrame, TopLevelReturnValue
+
+TOP_LEVEL = "<top level>"
+
+
+class FunctionStats:
+    def __init__(self):
+        self.calls = 0
+        self.steps = 0
+        self.inclusive_steps = 0
+        self.time = 0.0
+        self.inclusive_time = 0.0
+
+
+def function_name(operative):
+    name = "<lambda>" if operative.name is None else operative.name.text
+    return "{}::{}".format(operative.static_env.ns.name.text, name)
+
+
+class Profiler:
+    def __init__(self):
+        # function name -> FunctionStats
+        self.functions = {}
+        # (TOP_LEVEL, outermost function name, ..., innermost) -> [steps, time]
+        self.stacks = {}
+
+    def _stats(self, name):
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = FunctionStats()
+        return stats
+
+    def _record(self, stack_top, elapsed):
+        stack = [TOP_LEVEL]
+        for frame in sgml.interpreter.stacktrace(stack_top):
+            if isinstance(frame, OperativeStackFrame) and frame.combiner is not None:
+                stack.append(function_name(frame.combiner))
+        stack = tuple(stack)
+
+        totals = self.stacks.get(stack)
+        if totals is None:
+            totals = self.stacks[stack] = [0, 0.0]
+        totals[0] += 1
+        totals[1] += elapsed
+
+        stats = self._stats(stack[-1])
+        stats.steps += 1
+        stats.time += elapsed
+        # a recursive function is on the stack many times, but only includes each step once
+        for name in set(stack):
+            stats = self._stats(name)
+            stats.inclusive_steps += 1
+            stats.inclusive_time += elapsed
+
+    def run(self, rt, stack_top, code):
+        """
+        sgml.interpreter.run, recording each step. The time spent recording it
+        isn't charged to anything.
+        """
+        steps = 0
+        clock = time.perf_counter
+        try:
+            while True:
+                steps += 1
+                start = clock()
+                current = stack_top
+                frame_or_value = current.frame_or_value(rt)
+                if isinstance(frame_or_value, StackFrame):
+                    # "push"
+                    stack_top = frame_or_value
+                elif current.parent is None:
+                    self._record(current, clock() - start)
+                    return frame_or_value
+                elif isinstance(frame_or_value, TopLevelReturnValue):
+                    self._record(current, clock() - start)
+                    return frame_or_value.value
+                else:
+                    # "pop"
+                    stack_top = current.parent.with_value(rt, frame_or_value)
+                self._record(current, clock() - start)
+
+                if (
+                        stack_top is frame_or_value
+                        and isinstance(stack_top, OperativeStackFrame)
+                        and stack_top.combiner is not None
+                        and stack_top.operative_body is rt.operative_body(stack_top.combiner)
+                ):
+                    # a new call, not the next form of a body already running
+                    self._stats(function_name(stack_top.combiner)).calls += 1
+                if isinstance(stack_top, RuntimeErrorFrame):
+                    sgml.interpreter.raise_runtime_error(rt, stack_top, code)
+        finally:
+            sgml.interpreter.step_count += steps
+
+    def report(self, file=sys.stderr, limit=None):
+        """
+        Print each function's totals, the ones with the most exclusive time first
+        """
+        print("{:>8} {:>10} {:>10} {:>10} {:>10}  {}".format(
+            "calls", "steps", "incl steps", "time", "incl time", "function"
+        ), file=file)
+        ranked = sorted(self.functions.items(), key=lambda item: item[1].time, reverse=True)
+        for name, stats in ranked[:limit]:
+            print("{:>8} {:>10} {:>10} {:>10.4f} {:>10.4f}  {}".format(
+                stats.calls, stats.steps, stats.inclusive_steps, stats.time, stats.inclusive_time, name
+            ), file=file)
+
+    def write_collapsed(self, file, measure="steps"):
+        """
+        Write the stacks in the "collapsed" format that flamegraph.pl and
+        similar tools read: one line per stack, outermost function first.
+
+        :param measure: "steps", or "time" for wall time in microseconds
+        """
+        for stack, (steps, elapsed) in sorted(self.stacks.items()):
+            count = steps if measure == "steps" else round(elapsed * 1e6)
+            print("{} {}".format(";".join(stack), count), file=file)
@@ -1,15 +1,21 @@
 import sys
 
 import sgml.interpreter
+import sgml.interpreter.compiler
+import sgml.interpreter.profile
 import sgml.reader
 import sgml.rt
 
-USAGE = "Usage: python3 -m sgml.main [ -c <command> ] | [filename]"
+USAGE = "Usage: python3 -m sgml.main [ --compile ] [ --pure-core ] [ --profile [ --collapsed <file> ] ] [ -c <command> ] | [filename]"
 
 
 def main(args):
     command = None
     filename = None
+    evaluate = sgml.interpreter.evaluate
+    native_core = True
+    profile = False
+    collapsed = None
     i = 1
     while i < len(args):
         if args[i] in ("-h", "-help", "--help", "-?"):
@@ -21,6 +27,15 @@ def main(args):
                 return 1
             i += 1
             command = args[i]
+        elif args[i] in ("-C", "--compile"):
+            evaluate = sgml.interpreter.compiler.evaluate
+        elif args[i] == "--pure-core":
+            native_core = False
+        elif args[i] == "--profile":
+            profile = True
+        elif args[i] == "--collapsed":
+            i += 1
+            collapsed = args[i]
         else:
             if filename:
                 print(USAGE)
@@ -32,21 +47,36 @@ def main(args):
         print(USAGE)
         return
 
-    sgml.rt.init()
+    sgml.rt.init(native_core=native_core)
+
+    if profile or collapsed is not None:
+        # the profiler follows the frame interpreter's stack, so compiled code isn't profiled
+        evaluate = sgml.interpreter.evaluate
+        sgml.interpreter.profiler = sgml.interpreter.profile.Profiler()
+        try:
+            return run(evaluate, command, filename)
+        finally:
+            sgml.interpreter.profiler.report()
+            if collapsed is not None:
+                with open(collapsed, "w") as f:
+                    sgml.interpreter.profiler.write_collapsed(f)
+            sgml.interpreter.profiler = None
+    return run(evaluate, command, filename)
+
 
+def run(evaluate, command, filename):
     if command is not None:
         stream = sgml.reader.streams.StringStream(command)
         form = sgml.reader.read_one(sgml.rt, sgml.reader.INITIAL_MACROS, stream)
-        sgml.interpreter.evaluate(sgml.rt, form)
+        evaluate(sgml.rt, form)
         return 0
 
     if filename is not None:
-        with open(filename, 'r') as f:
-            stream = sgml.reader.streams.LineNumberingStream(sgml.reader.streams.FileStream(f))
-            forms = sgml.reader.read_many(sgml.rt, sgml.reader.INITIAL_MACROS, stream)
+        with sgml.reader.streams.open_file(filename) as f:
+            stream = sgml.reader.streams.LineNumberingStream(f)
             sgml.interpreter._debug = True
-            for form in sgml.rt.iter_elements(forms):
-                sgml.interpreter.evaluate(sgml.rt, form)
+            for form in sgml.reader.iter_forms(sgml.rt, sgml.reader.INITIAL_MACROS, stream):
+                evaluate(sgml.rt, form)
         return 0
     return 0
 
@@ -15,6 +15,12 @@ _ESCAPE_CHARS = {
 }
 _INT_PAT = re.compile("[0-9]+")
 
+# Runs of characters for Stream.read_while
+_WHITESPACE_RUN = re.compile("[ \n\t]*")
+_LINE_RUN = re.compile("[^\n]*")
+_STRING_RUN = re.compile('[^"\\\\]*')
+
+
 @dataclass
 class ReaderState:
     rt: object
@@ -22,27 +28,24 @@ class ReaderState:
     stream: Stream
     dotted_lists: bool = True
 
+    def __post_init__(self):
+        self.token_pattern = self.macros.token_pattern()
 
-def _is_whitespace(ch):
-    return ch == ' ' or ch == '\n' or ch == '\t'
 
+def _read_token(state):
+    """
+    Skip whitespace, then read a token if one starts there.
 
-def _is_constituent(macros, ch):
-    if _is_whitespace(ch) or macros.is_terminating(ch):
-        return False
-    # todo: probably more cases
-    return True
-
-def _read_token(state, ch):
-    result = ch
-    for ch in state.stream:
-        if _is_whitespace(ch) or state.macros.is_terminating(ch):
-            state.stream.ungetc(ch)
-            break
-        elif _is_constituent(state.macros, ch):
-            result += ch
-        else:
-            raise state.stream.error("Nonconstituent character '{}'".format(ch))
+    :return: The token's value, or None if the next character is a macro
+        character (or there is none)
+    """
+    result = state.stream.read_while(state.token_pattern).lstrip(" \n\t")
+    if not result:
+        return None
+    if state.stream.at_eof():
+        # we used to find the end of a token by reading past it, so make sure
+        # errors at EOF still report the same column
+        next(state.stream, None)
     if result == "*t*":
         return state.rt.true()
     if result == "nil":
@@ -53,13 +56,12 @@ def _read_token(state, ch):
 
 
 def _read(state):
+    token = _read_token(state)
+    if token is not None:
+        return token
     for ch in state.stream:
-        if _is_whitespace(ch):
-            continue
-        if ch in state.macros.initial:
-            f = state.macros.initial[ch]
-            return f(state, ch)
-        return _read_token(state, ch)
+        f = state.macros.initial[ch]
+        return f(state, ch)
 
 
 def _read_list(state, ch):
@@ -67,20 +69,26 @@ def _read_list(state, ch):
     forms = []
     dotted = False
     seen_improper_cdr = False
-    for ch in state.stream:
-        if _is_whitespace(ch):
-            continue
-        if ch == ')':
-            if state.dotted_lists:
-                return state.rt.forms_to_list(forms, dotted)
-            return tuple(forms)
-
+    while True:
+        next_form = None
         if dotted and seen_improper_cdr:
-            raise state.stream.error("Expected one cdr in dotted s-expression")
-        state.stream.ungetc(ch)
-        next_form = _read(state)
+            # nothing but the closing paren can follow
+            state.stream.read_while(_WHITESPACE_RUN)
+        else:
+            next_form = _read_token(state)
         if next_form is None:
-            continue
+            ch = next(state.stream, None)
+            if ch is None:
+                break
+            if ch == ')':
+                if state.dotted_lists:
+                    return state.rt.forms_to_list(forms, dotted)
+                return tuple(forms)
+            if dotted and seen_improper_cdr:
+                raise state.stream.error("Expected one cdr in dotted s-expression")
+            next_form = state.macros.initial[ch](state, ch)
+            if next_form is None:
+                continue
         if next_form == state.rt.symbol('.'):
             if not state.dotted_lists:
                 raise state.stream.error("Dotted s-expressions are disabled")
@@ -96,9 +104,8 @@ def _read_list(state, ch):
 
 def _read_line_comment(state, ch):
     assert ch == ';'
-    for ch in state.stream:
-        if ch == '\n':
-            break
+    state.stream.read_while(_LINE_RUN)
+    next(state.stream, None)  # the newline
     return None
 
 
@@ -146,21 +153,21 @@ def _ignore(state, ch):
 
 def _read_string(state, ch):
     assert ch == '"'
-    text = ""
-    escaped = False
-    for ch in state.stream:
-        if escaped:
-            if ch in _ESCAPE_CHARS:
-                text += _ESCAPE_CHARS[ch]
-                escaped = False
-            else:
-                raise state.stream.error("Illegal escape character: '{}'".format(ch))
-        elif ch == '\\':
-            escaped = True
-        elif ch == '"':
-            return state.rt.string(text)
-        else:
-            text += ch
+    chunks = []
+    while True:
+        chunks.append(state.stream.read_while(_STRING_RUN))
+        ch = next(state.stream, None)
+        if ch is None:
+            break
+        if ch == '"':
+            return state.rt.string("".join(chunks))
+        # a backslash
+        ch = next(state.stream, None)
+        if ch is None:
+            break
+        if ch not in _ESCAPE_CHARS:
+            raise state.stream.error("Illegal escape character: '{}'".format(ch))
+        chunks.append(_ESCAPE_CHARS[ch])
     raise state.stream.error("EOF while reading string literal")
 
 
@@ -171,23 +178,28 @@ def _unmatched_delimiter(state, ch):
 def read_one(rt, macros, stream):
     state = ReaderState(rt, macros, stream)
     result = _read(state)
+    state.stream.read_while(_WHITESPACE_RUN)
     for ch in state.stream:
-        if not _is_whitespace(ch):
-            state.stream.ungetc(ch)
-            raise state.stream.error(
-                "Unconsumed input: \"{}\"".format(state.stream.remainder())
-            )
+        state.stream.ungetc(ch)
+        raise state.stream.error(
+            "Unconsumed input: \"{}\"".format(state.stream.remainder())
+        )
     return result
 
 
-def read_many(rt, macros, stream):
+def iter_forms(rt, macros, stream):
+    """
+    Read the forms in `stream` one at a time, as they're needed.
+    """
     state = ReaderState(rt, macros, stream)
-    forms = []
     while not state.stream.at_eof():
         form = _read(state)
         if form is not None:
-            forms.append(form)
-    return state.rt.forms_to_list(forms)
+            yield form
+
+
+def read_many(rt, macros, stream):
+    return rt.forms_to_list(list(iter_forms(rt, macros, stream)))
 
 
 INITIAL_MACROS = Macros(
@@ -1,3 +1,6 @@
+import re
+
+
 class Macros:
     def __init__(self, initial, dispatch):
         self.initial = initial
@@ -5,3 +8,14 @@ class Macros:
 
     def is_terminating(self, ch):
         return ch in self.initial and ch != "'"
+
+    def token_pattern(self):
+        """
+        :return: Pattern for whitespace followed by a token, if one starts there
+        """
+        initial = "".join(self.initial)
+        terminating = "".join(ch for ch in self.initial if self.is_terminating(ch))
+        return re.compile("[ \\n\\t]*(?:[^ \\n\\t{}][^ \\n\\t{}]*)?".format(
+            re.escape(initial),
+            re.escape(terminating),
+        ))
@@ -1,4 +1,11 @@
+import mmap
+import os
+import re
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+# Files bigger than this many bytes are read through an MmapStream
+MMAP_THRESHOLD = 1 << 20
 
 
 class Stream(ABC):
@@ -23,6 +30,24 @@ class Stream(ABC):
     def ungetc(self, ch):
         raise NotImplementedError()
 
+    def read_while(self, pattern) -> str:
+        """
+        Consume and return the longest text at the current position that
+        `pattern` matches. Every prefix of a match must match too (e.g. "[^x]*"),
+        so that buffered streams can match against what they have buffered and
+        try again with more input if the match reaches its end.
+
+        This does one character at a time; streams that hold their input in a
+        buffer should match the pattern against the buffer instead.
+        """
+        result = ""
+        for ch in self:
+            if not pattern.fullmatch(result + ch):
+                self.ungetc(ch)
+                break
+            result += ch
+        return result
+
     @abstractmethod
     def remainder(self) -> str:
         raise NotImplementedError()
@@ -63,22 +88,42 @@ class LineNumberingStream(Stream):
         except StopIteration:
             stop_iteration = True
 
+        self._advance(1)
+        self._at_line_end = ch == '\n'
+
+        if stop_iteration:
+            raise StopIteration
+        return ch
+
+    def read_while(self, pattern):
+        text = self.stream.read_while(pattern)
+        if text:
+            # the same as calling __next__ for each character
+            self._advance(len(text))
+            last = len(text) - 1
+            newlines = text.count('\n', 0, last) if '\n' in text else 0
+            if newlines:
+                self._line_number += newlines
+                self._column_number = last - text.rindex('\n', 0, last)
+                self._prev_column_number = self._column_number
+            self._at_line_end = text[last] == '\n'
+        return text
+
+    def _advance(self, count):
+        """
+        Account for `count` more characters, as if there were no line breaks
+        among them.
+        """
         if self._init:
             self._init = False
             self._line_number = 1
-            self._column_number = 1
+            self._column_number = count
         elif self._at_line_end:
             self._line_number += 1
-            self._column_number = 1
+            self._column_number = count
         else:
-            self._column_number += 1
-
+            self._column_number += count
         self._prev_column_number = self._column_number
-        self._at_line_end = ch == '\n'
-
-        if stop_iteration:
-            raise StopIteration
-        return ch
 
     def at_eof(self):
         return self.stream.at_eof()
@@ -104,31 +149,58 @@ class LineNumberingStream(Stream):
 
 
 class FileStream(Stream):
+    BLOCK_SIZE = 1 << 16
+
     def __init__(self, f):
         self.f = f
         self._at_eof = False
-        self._ungetc_buf = ''
+        self._buffer = ''
+        self._position = 0
+
+    def _fill(self):
+        """
+        Read the next block of the file into the buffer.
+
+        :return: False if there was nothing left to read
+        """
+        if self._at_eof:
+            return False
+        block = self.f.read(self.BLOCK_SIZE)
+        if block == '':
+            self._at_eof = True
+            return False
+        self._buffer = self._buffer[self._position:] + block
+        self._position = 0
+        return True
 
     def __next__(self):
-        if len(self._ungetc_buf) > 0:
-            result = self._ungetc_buf
-            self._ungetc_buf = ''
-            return result
-
-        result = self.f.read(1)
-        if result == '':
-            self._at_eof = True
+        if self._position >= len(self._buffer) and not self._fill():
             raise StopIteration
+        result = self._buffer[self._position]
+        self._position += 1
+        return result
+
+    def read_while(self, pattern):
+        while True:
+            end = pattern.match(self._buffer, self._position).end()
+            if end < len(self._buffer) or not self._fill():
+                break
+        result = self._buffer[self._position:end]
+        self._position = end
         return result
 
     def at_eof(self):
-        return len(self._ungetc_buf) == 0 and self._at_eof
+        return self._position >= len(self._buffer) and not self._fill()
 
     def ungetc(self, ch):
-        self._ungetc_buf = ch + self._ungetc_buf
+        if self._position > 0 and self._buffer[self._position - 1] == ch:
+            self._position -= 1
+        else:
+            self._buffer = ch + self._buffer[self._position:]
+            self._position = 0
 
     def remainder(self):
-        return self._ungetc_buf + self.f.read()
+        return self._buffer[self._position:] + self.f.read()
 
     def error(self, message):
         return StreamError(message)
@@ -152,6 +224,12 @@ class StringStream(Stream):
         self.position += 1
         return result
 
+    def read_while(self, pattern):
+        end = pattern.match(self.text, self.position).end()
+        result = self.text[self.position:end]
+        self.position = end
+        return result
+
     def at_eof(self):
         return self.position >= len(self.text)
 
@@ -163,3 +241,91 @@ class StringStream(Stream):
 
     def error(self, message):
         return StreamError(message)
+
+
+# str pattern -> the same pattern for UTF-8 bytes, or None if it can't be one
+_BYTE_PATTERNS = {}
+
+
+class MmapStream(Stream):
+    """
+    Memory-maps a UTF-8 source file and scans it in place as bytes, only
+    decoding the text that read_while() and __next__ return.
+    """
+
+    def __init__(self, f):
+        """
+        :param f: File opened in binary mode. It can be closed once this is
+            created; call close() when done with the stream instead.
+        """
+        size = os.fstat(f.fileno()).st_size
+        self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self._size = size
+        self.position = 0
+
+    def __next__(self):
+        if self.position >= self._size:
+            raise StopIteration
+        byte = self._map[self.position]
+        if byte < 0x80:
+            self.position += 1
+            return chr(byte)
+        end = self.position + (2 if byte < 0xe0 else 3 if byte < 0xf0 else 4)
+        result = self._map[self.position:end].decode()
+        self.position = end
+        return result
+
+    def read_while(self, pattern):
+        byte_pattern = _BYTE_PATTERNS.get(pattern, pattern)
+        if byte_pattern is pattern:
+            byte_pattern = _BYTE_PATTERNS[pattern] = _byte_pattern(pattern)
+        if byte_pattern is None:
+            return super(MmapStream, self).read_while(pattern)
+        end = byte_pattern.match(self._map, self.position).end()
+        result = self._map[self.position:end].decode()
+        self.position = end
+        return result
+
+    def at_eof(self):
+        return self.position >= self._size
+
+    def ungetc(self, ch):
+        self.position -= 1 if ch < "\x80" else len(ch.encode("utf-8"))
+
+    def remainder(self):
+        return self._map[self.position:].decode()
+
+    def error(self, message):
+        return StreamError(message)
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+
+def _byte_pattern(pattern):
+    """
+    A pattern written in ASCII matches the same text as UTF-8 bytes: anything
+    it doesn't mention is outside ASCII, and so entirely bytes >= 0x80.
+    """
+    if not pattern.pattern.isascii():
+        return None
+    return re.compile(pattern.pattern.encode("ascii"), pattern.flags & ~re.UNICODE)
+
+
+@contextmanager
+def open_file(path):
+    """
+    Open the source file at `path` as a FileStream, or as an MmapStream if it's
+    bigger than MMAP_THRESHOLD bytes.
+    """
+    if os.path.getsize(path) <= MMAP_THRESHOLD:
+        with open(path) as f:
+            yield FileStream(f)
+        return
+    with open(path, "rb") as f:
+        stream = MmapStream(f)
+    try:
+        yield stream
+    finally:
+        stream.close()
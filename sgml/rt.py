@@ -1,14 +1,19 @@
 import functools
+import hashlib
 import operator as op
 import os
+import pickle
 import sys
-from contextlib import contextmanager
+import tempfile
+from contextlib import contextmanager, suppress
+from types import MappingProxyType
 
 import sgml.interpreter
+import sgml.interpreter.compiler
 import sgml.reader
 from sgml.symbol import Symbol
 from sgml.environment import Namespace
-from sgml.thunk import Applicative, Continuation, Operative, PrimitiveFunction
+from sgml.thunk import Applicative, Continuation, DelimitedContinuation, Operative, PrimitiveFunction, Promise
 
 
 def forms_to_list(forms, dotted=False):
@@ -141,6 +146,17 @@ def is_operative(value):
     return isinstance(value, Operative)
 
 
+def name_combiner(value, name: Symbol):
+    """
+    Record `name` as the name of the operative that `value` is or wraps, unless
+    it already has one (so aliases don't rename it), for the profiler
+    """
+    while isinstance(value, Applicative):
+        value = value.combiner
+    if isinstance(value, Operative) and value.name is None:
+        value.name = name
+
+
 def operative_parameters(f: Operative):
     return f.parameters
 
@@ -169,12 +185,51 @@ def continuation(frame):
     return Continuation(frame)
 
 
+def delimited_continuation(frame):
+    return DelimitedContinuation(frame)
+
+
+def is_delimited_continuation(value):
+    return isinstance(value, DelimitedContinuation)
+
+
 def continuation_frame(continuation):
     return continuation.frame
 
 
+def promise(compute):
+    return Promise(compute)
+
+
+def is_promise(value):
+    return isinstance(value, Promise)
+
+
+def force(value):
+    """
+    :return: `value`, or if it's a promise, the value of its delayed form,
+        evaluating that form the first time and remembering it after. A promise
+        that yields another promise is forced in turn.
+    """
+    pending = []
+    while isinstance(value, Promise):
+        if value.done:
+            value = value.value
+            continue
+        pending.append(value)
+        compute = value.compute
+        value = compute()
+    for p in pending:
+        # the first of a chain of promises to finish also settles the rest
+        if not p.done:
+            p.done = True
+            p.value = value
+            p.compute = None
+    return value
+
+
 def wrap(f):
-    if is_operative(f):
+    if is_operative(f) or is_special_form(f):
         return Applicative(f)
     if is_applicative(f):
         return f
@@ -202,13 +257,15 @@ PRIMITIVE_FUNCTIONS = {
     name: PrimitiveFunction(name, func)
 
     for (name, func) in [
-        ("car", lambda arguments, env: first(first(arguments))),
-        ("caar", lambda arguments, env: first(first(first(arguments)))),
-        ("cdr", lambda arguments, env: rest(first(arguments))),
+        # car, cdr, atom and null force promises, so they work on lazy sequences
+        ("car", lambda arguments, env: first(force(first(arguments)))),
+        ("caar", lambda arguments, env: first(force(first(force(first(arguments)))))),
+        ("cdr", lambda arguments, env: force(rest(force(first(arguments))))),
         ("cons", lambda arguments, env: cons(first(arguments), second(arguments))),
-        ("atom", lambda arguments, env: is_atom(first(arguments))),
+        ("atom", lambda arguments, env: is_atom(force(first(arguments)))),
         ("eq", lambda arguments, env: eq(first(arguments), second(arguments))),
-        ("null", lambda arguments, env: is_null(first(arguments))),
+        ("null", lambda arguments, env: is_null(force(first(arguments)))),
+        ("force", lambda arguments, env: force(first(arguments))),
         ("list", lambda arguments, env: arguments),
         ("+", lambda arguments, env: functools.reduce(op.add, iter_elements(arguments), 0)),
         ("-", lambda arguments, env: functools.reduce(op.sub, iter_elements(arguments))),
@@ -235,40 +292,68 @@ class SpecialForm:
         return "SpecialForm({})".format(self.name)
 
 
-QUOTE = SpecialForm("quote")
-COND = SpecialForm("cond")
-EVAL = SpecialForm("eval")
-FEXPR = SpecialForm("fexpr")
-LABEL = SpecialForm("label")
-DEFINE = SpecialForm("define")
-LET = SpecialForm("let")  # TODO: define as fexpr when am more comfortable
-IGNORE = SpecialForm("_")
-CALL_CC = SpecialForm("call/cc")
-SET = SpecialForm("set!")
-QUASIQUOTE = SpecialForm("quasiquote")
-NS = SpecialForm("ns")
-REQUIRE = SpecialForm("require")
-LOAD = SpecialForm("load")
-
-SPECIAL_FORMS = {
-    form.name: form
-    for form in [
-    QUOTE,
-    COND,
-    EVAL,
-    FEXPR,
-    LABEL,
-    DEFINE,
-    LET,
-    IGNORE,
-    CALL_CC,
-    SET,
-    QUASIQUOTE,
-    NS,
-    REQUIRE,
-    LOAD,
-]
-}
+def is_special_form(value):
+    return isinstance(value, SpecialForm)
+
+
+SPECIAL_FORMS = {}
+SPECIAL_FORM_HANDLERS = {}
+SPECIAL_FORM_COMPILERS = {}
+
+
+def register_special_form(name, handler, compiler=None):
+    """
+    Add a special form to the language. Namespaces created by later calls to
+    init() will have it bound to `name`.
+
+    :param name: The symbol text the special form is bound to
+    :param handler: func(rt, frame) -> value or StackFrame, called with the
+        DispatchStackFrame whose head evaluated to the special form. To take more
+        than one step, return an instance of your own StackFrame subclass with
+        scope=frame.scope and parent=frame.parent. None leaves the form
+        unimplemented: using it is a "non-applicable object" error.
+    :param compiler: Optional func(rt, form, context) -> func(scope) -> value for
+        sgml.interpreter.compiler. Without one, compiled code dispatches the form
+        to `handler` in a frame of its own.
+    :return: The new SpecialForm
+    """
+    global _cached_primitives, _cached_core_ns
+    form = SpecialForm(name)
+    SPECIAL_FORMS[name] = form
+    if handler is not None:
+        SPECIAL_FORM_HANDLERS[form] = handler
+    if compiler is not None:
+        SPECIAL_FORM_COMPILERS[form] = compiler
+    _cached_primitives = None
+    _cached_core_ns = None
+    return form
+
+
+QUOTE = register_special_form("quote", sgml.interpreter.dispatch_quote, sgml.interpreter.compiler.compile_quote)
+COND = register_special_form("cond", sgml.interpreter.dispatch_cond, sgml.interpreter.compiler.compile_cond)
+EVAL = register_special_form("eval", sgml.interpreter.dispatch_eval, sgml.interpreter.compiler.compile_eval)
+FEXPR = register_special_form("fexpr", sgml.interpreter.dispatch_fexpr, sgml.interpreter.compiler.compile_fexpr)
+LABEL = register_special_form("label", sgml.interpreter.dispatch_label, sgml.interpreter.compiler.compile_label)
+DEFINE = register_special_form("define", sgml.interpreter.dispatch_define, sgml.interpreter.compiler.compile_define)
+LET = register_special_form("let", sgml.interpreter.dispatch_let, sgml.interpreter.compiler.compile_let)  # TODO: define as fexpr when am more comfortable
+IGNORE = register_special_form("_", sgml.interpreter.dispatch_ignore, sgml.interpreter.compiler.compile_ignore)
+CALL_CC = register_special_form("call/cc", sgml.interpreter.dispatch_call_cc)
+RESET = register_special_form("reset", sgml.interpreter.dispatch_reset)
+SHIFT = register_special_form("shift", sgml.interpreter.dispatch_shift)
+DELAY = register_special_form("delay", sgml.interpreter.dispatch_delay, sgml.interpreter.compiler.compile_delay)
+SET = register_special_form("set!", sgml.interpreter.dispatch_define, sgml.interpreter.compiler.compile_set)
+QUASIQUOTE = register_special_form("quasiquote", None)  # TODO: not implemented yet
+NS = register_special_form("ns", sgml.interpreter.dispatch_ns, sgml.interpreter.compiler.compile_ns)
+REQUIRE = register_special_form("require", sgml.interpreter.dispatch_require, sgml.interpreter.compiler.compile_require)
+LOAD = register_special_form("load", sgml.interpreter.dispatch_load, sgml.interpreter.compiler.compile_load)
+
+# Native versions of the combiners in lib/core_pure.sgml, which init(native_core=False) loads instead
+LAMBDA = register_special_form("lambda", sgml.interpreter.dispatch_lambda, sgml.interpreter.compiler.compile_lambda)
+DEFN = register_special_form("defn", sgml.interpreter.dispatch_defn, sgml.interpreter.compiler.compile_defn)
+IF = register_special_form("if", sgml.interpreter.dispatch_if, sgml.interpreter.compiler.compile_if)
+AND = register_special_form("and", sgml.interpreter.dispatch_and, sgml.interpreter.compiler.compile_and)
+BEGIN = register_special_form("begin", sgml.interpreter.dispatch_begin, sgml.interpreter.compiler.compile_begin)
+APPLY = register_special_form("apply", sgml.interpreter.dispatch_apply, sgml.interpreter.compiler.compile_apply)
 
 
 _cached_primitives = None
@@ -276,11 +361,13 @@ def primitives():
     global _cached_primitives
     if _cached_primitives is None:
         primitives = {
-            't': true(),
-            'nil': null(),
+            symbol('t'): true(),
+            symbol('nil'): null(),
         }
-        primitives.update(SPECIAL_FORMS)
-        primitives.update(PRIMITIVE_FUNCTIONS)
+        primitives.update((symbol(name), form) for name, form in SPECIAL_FORMS.items())
+        primitives.update((symbol(name), f) for name, f in PRIMITIVE_FUNCTIONS.items())
+        # apply evaluates its operands
+        primitives[symbol("apply")] = wrap(APPLY)
         _cached_primitives = primitives
     return _cached_primitives
 
@@ -302,27 +389,199 @@ def namespace_context(next_ns=None):
         _CURRENT_NS = _current_ns
 
 
-def _do_load_file(f):
-    stream = sgml.reader.streams.LineNumberingStream(sgml.reader.streams.FileStream(f))
+CACHE_DIR_NAME = "__sgmlcache__"
+# Bump whenever a change to the reader changes what it makes of existing files
+FORMS_CACHE_VERSION = 1
+# False to parse every file that's loaded instead of caching its forms
+CACHE_FORMS = True
+
+
+def _write_cache_file(path, dump):
+    """
+    Write a file under a __sgmlcache__ directory. It's written under a temporary
+    name and then renamed, so other processes never see it half-written.
+    Failing to write it isn't an error: the cache is only an optimization.
+
+    :param dump: func(f) that writes the contents to the open binary file f
+    """
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        f = tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False)
+    except OSError:
+        # e.g. a read-only install
+        return
+    try:
+        with f:
+            dump(f)
+        os.replace(f.name, path)
+    except (OSError, pickle.PicklingError, RecursionError):
+        # RecursionError: a form nested too deeply to pickle
+        with suppress(OSError):
+            os.unlink(f.name)
+
+
+def _forms_cache_path(path):
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, CACHE_DIR_NAME, filename + ".forms")
+
+
+def _read_cached_forms(path, stat):
+    """
+    :return: The top-level forms in the file at `path`, or None if they aren't
+        cached or the file has changed since they were
+    """
+    try:
+        with open(_forms_cache_path(path), "rb") as f:
+            version, mtime, size, forms = pickle.load(f)
+    except Exception:
+        # missing or unreadable: parse the file instead
+        return None
+    if (version, mtime, size) != (FORMS_CACHE_VERSION, stat.st_mtime_ns, stat.st_size):
+        return None
+    return forms
+
+
+def _do_load_file(path):
     # https://stackoverflow.com/questions/1676835/how-to-get-a-reference-to-a-module-inside-the-module-itself/1676860#1676860
     module = sys.modules[__name__]
-    forms = sgml.reader.read_many(module, sgml.reader.INITIAL_MACROS, stream)
-    for form in iter_elements(forms):
-        sgml.interpreter.evaluate(module, form)
+    stat = os.stat(path)
+    forms = _read_cached_forms(path, stat) if CACHE_FORMS else None
+    if forms is not None:
+        for form in forms:
+            sgml.interpreter.evaluate(module, form)
+        return
+
+    forms = []
+    with sgml.reader.streams.open_file(path) as f:
+        stream = sgml.reader.streams.LineNumberingStream(f)
+        for form in sgml.reader.iter_forms(module, sgml.reader.INITIAL_MACROS, stream):
+            forms.append(form)
+            sgml.interpreter.evaluate(module, form)
+    if CACHE_FORMS:
+        # stat is from before the file was read, so a change made while reading it invalidates the cache
+        _write_cache_file(
+            _forms_cache_path(path),
+            lambda f: pickle.dump((FORMS_CACHE_VERSION, stat.st_mtime_ns, stat.st_size, forms), f, protocol=4)
+        )
+
+
+_native_core = True
+_cached_core_ns = None
+_cached_stdlib_env = None
+
+# Bump whenever a change to the interpreter makes existing images unusable
+IMAGE_VERSION = 2
+# Where init() keeps images of the loaded stdlib; None to evaluate it every time
+IMAGE_DIR = os.path.join(os.path.dirname(__file__), "lib", CACHE_DIR_NAME)
+
+
+def _stdlib_paths():
+    files = ["core.sgml"] if _native_core else ["core_pure.sgml", "core.sgml"]
+    return [os.path.join(os.path.dirname(__file__), "lib", filename) for filename in files]
+
+
+def _image_key():
+    h = hashlib.sha256(str(IMAGE_VERSION).encode())
+    for path in _stdlib_paths():
+        with open(path, "rb") as f:
+            h.update(os.path.basename(path).encode() + b"\0" + f.read() + b"\0")
+    return h.hexdigest()[:16]
+
+
+class _ImagePickler(pickle.Pickler):
+    """
+    Special forms and primitive functions are saved by name, and the core
+    namespace by reference, so an image only holds what the stdlib defined.
+    """
+    def __init__(self, f, core):
+        super(_ImagePickler, self).__init__(f, protocol=4)
+        self.core = core
+
+    def persistent_id(self, obj):
+        if obj is self.core:
+            return ("namespace", None)
+        if isinstance(obj, SpecialForm):
+            return ("special form", obj.name)
+        if isinstance(obj, PrimitiveFunction):
+            return ("primitive", obj.name)
+        return None
+
+
+class _ImageUnpickler(pickle.Unpickler):
+    def __init__(self, f, core):
+        super(_ImageUnpickler, self).__init__(f)
+        self.core = core
+
+    def persistent_load(self, pid):
+        kind, name = pid
+        if kind == "namespace":
+            return self.core
+        if kind == "special form":
+            return SPECIAL_FORMS[name]
+        return PRIMITIVE_FUNCTIONS[name]
+
+
+def _read_image(key, core):
+    """
+    :return: The stdlib's definitions in the core namespace, or None if there's
+        no usable image for this version of the stdlib
+    """
+    if IMAGE_DIR is None:
+        return None
+    try:
+        with open(os.path.join(IMAGE_DIR, "stdlib-{}.image".format(key)), "rb") as f:
+            version, image_key, definitions = _ImageUnpickler(f, core).load()
+    except Exception:
+        # missing, unreadable or from an incompatible interpreter: evaluate the stdlib instead
+        return None
+    if version != IMAGE_VERSION or image_key != key:
+        return None
+    return definitions
+
+
+def _write_image(key, core, definitions):
+    if IMAGE_DIR is None:
+        return
+    _write_cache_file(
+        os.path.join(IMAGE_DIR, "stdlib-{}.image".format(key)),
+        lambda f: _ImagePickler(f, core).dump((IMAGE_VERSION, key, definitions))
+    )
+
+
+def _load_stdlib():
+    global _cached_core_ns, _cached_stdlib_env
+    core = Namespace(symbol("core"), dict(primitives()))
+    _NS_BY_NAME["core"] = core
+    key = _image_key()
+    definitions = _read_image(key, core)
+    if definitions is None:
+        with namespace_context(core):
+            for path in _stdlib_paths():
+                _do_load_file(path)
+        base = primitives()
+        definitions = {s: v for s, v in core.env.items() if s not in base or base[s] is not v}
+        _write_image(key, core, definitions)
+    else:
+        core.env.update(definitions)
+    # from here on, definitions in core go in an overlay that reset() can drop
+    _cached_core_ns = core
+    _cached_stdlib_env = MappingProxyType(core.env)
+    core.env, core.base = {}, _cached_stdlib_env
 
 
-_cached_stdlib_env_dict = None
 def stdlib_env():
-    global _cached_stdlib_env_dict
-    if _cached_stdlib_env_dict is None:
-        with open(os.path.join(os.path.dirname(__file__), "lib", "core.sgml")) as f:
-            _do_load_file(f)
-        _cached_stdlib_env_dict = dict(current_ns().env)
-    return _cached_stdlib_env_dict
+    """
+    :return: A read-only mapping of everything defined in core by the stdlib,
+        shared by every namespace as the layer under its own definitions
+    """
+    if _cached_core_ns is None:
+        _load_stdlib()
+    return _cached_stdlib_env
 
 
 def _create_ns(name: Symbol):
-    new_ns = Namespace(name, stdlib_env())
+    new_ns = Namespace(name, base=stdlib_env())
     _NS_BY_NAME[name.text] = new_ns
     return new_ns
 
@@ -338,14 +597,14 @@ def set_current_ns(name: Symbol):
 
 def require_ns(name: Symbol):
     if name.text in _NS_BY_NAME:
-        return _NS_BY_NAME[name.text]
+        current_ns().add_import(_NS_BY_NAME[name.text])
+        return
     with namespace_context():
         new_ns = _create_ns(name)
         loaded = False
         for p in _IMPORT_SEARCH_PATHS:
             try:
-                with open(os.path.join(p, name.text + ".sgml")) as f:
-                    _do_load_file(f)
+                _do_load_file(os.path.join(p, name.text + ".sgml"))
             except FileNotFoundError:
                 continue
             loaded = True
@@ -355,8 +614,7 @@ def require_ns(name: Symbol):
 
 
 def load_file(path: str):
-    with open(path) as f:
-        _do_load_file(f)
+    _do_load_file(path)
 
 
 def debug(form) -> str:
@@ -375,12 +633,37 @@ def debug(form) -> str:
     )
 
 def fresh_scope():
-    return Namespace(symbol(""), stdlib_env()).scope()
-
-
-def init():
+    return Namespace(symbol(""), base=stdlib_env()).scope()
+
+
+def init(native_core=True):
+    """
+    Set up the core and user namespaces. The stdlib is evaluated once per
+    process, or not at all when IMAGE_DIR has an image of it from an earlier run.
+
+    :param native_core: If false, use the definitions of lambda, defn, if, and,
+        begin and apply in lib/core_pure.sgml instead of the native ones
+    """
+    global _native_core, _cached_primitives, _cached_core_ns
+    if native_core != _native_core:
+        _native_core = native_core
+        _cached_primitives = None
+        _cached_core_ns = None
+    reset()
+
+
+def reset():
+    """
+    Return to the state init() left things in, without evaluating anything:
+    undo every definition made since, and forget every namespace but core and
+    a fresh user namespace.
+    """
     global _CURRENT_NS
-    bootstrap = Namespace(symbol("core"), primitives())
-    _CURRENT_NS = bootstrap
-    _NS_BY_NAME["core"] = bootstrap
+    if _cached_core_ns is None:
+        _load_stdlib()
+    core = _cached_core_ns
+    core.env.clear()
+    core.imports.clear()
+    _NS_BY_NAME.clear()
+    _NS_BY_NAME["core"] = core
     _CURRENT_NS = _create_ns(symbol("user"))
@@ -1,25 +1,44 @@
+_INTERNED = {}
+
+
 class Symbol:
-    def __init__(self, text: str, ns=None):
+    """
+    Symbols are interned: Symbol(...) returns the one canonical object for a given
+    namespace and text, so symbols compare and hash by identity.
+    """
+    __slots__ = ("ns", "text")
+
+    def __new__(cls, text: str, ns=None):
+        key = text if ns is None else (ns, text)
+        result = _INTERNED.get(key)
+        if result is not None:
+            return result
+
+        result = object.__new__(cls)
         if ns is not None:
-            self.ns = ns
-            self.text = text
+            result.ns = ns
+            result.text = text
         elif "::" in text:
             parts = text.split("::", 2)
-            self.ns = parts[0]
-            self.text = parts[1]
+            result.ns = parts[0]
+            result.text = parts[1]
+            # "ns::text" and Symbol("text", "ns") are the same symbol
+            result = _INTERNED.setdefault((result.ns, result.text), result)
         else:
-            self.ns = None
-            self.text = text
+            result.ns = None
+            result.text = text
+        _INTERNED[key] = result
+        return result
+
+    def __reduce__(self):
+        return Symbol, (self.text, self.ns)
 
     def with_ns(self, ns: str):
         assert self.ns is None
         return Symbol(self.text, ns)
 
-    def __hash__(self):
-        return hash((self.ns, self.text))
-
-    def __eq__(self, other):
-        return isinstance(other, Symbol) and (self.ns, self.text) == (other.ns, other.text)
+    def without_ns(self):
+        return Symbol(self.text)
 
     def __str__(self):
         if self.ns:
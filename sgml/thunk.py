@@ -8,12 +8,30 @@ class Continuation:
         self.frame = frame
 
 
+class DelimitedContinuation(Continuation):
+    """
+    The frames between a `shift` and its `reset`, with the outermost one's
+    parent cut off, so it holds on to nothing above the reset. `frame` is the
+    innermost one.
+    """
+
+
 class Operative:
     def __init__(self, parameters, dynamic_env_parameter, body, static_env):
         self.parameters = parameters
         self.dynamic_env_parameter = dynamic_env_parameter
         self.body = body
         self.static_env = static_env
+        # the symbol it was first defined or labelled as, see sgml.rt.name_combiner
+        self.name = None
+        # body as compiled by sgml.interpreter.compiler, filled in on first use
+        self.compiled = None
+
+    def __getstate__(self):
+        # compiled code is a tree of closures, which can't be pickled
+        state = dict(self.__dict__)
+        state["compiled"] = None
+        return state
 
 
 class PrimitiveFunction:
@@ -23,3 +41,19 @@ class PrimitiveFunction:
 
     def __str__(self):
         return "<primitive function '{}'>".format(self.name)
+
+
+class Promise:
+    """
+    The value of a `delay`ed form, computed the first time it's forced (see
+    sgml.rt.force) and remembered from then on.
+    """
+    def __init__(self, compute):
+        # func() -> value, dropped once it's been called so whatever it closes
+        # over can be collected
+        self.compute = compute
+        self.done = False
+        self.value = None
+
+    def __str__(self):
+        return "<promise>"
@@ -7,6 +7,8 @@ import unittest
 
 
 class SgmlTestCase(unittest.TestCase):
+    evaluate = staticmethod(sgml.interpreter.evaluate)
+
     def setUp(self):
         self.rt = sgml.rt
         self.rt.init()
@@ -19,7 +21,7 @@ class SgmlTestCase(unittest.TestCase):
         )
         result = None
         for form in self.rt.iter_elements(forms):
-            result = sgml.interpreter.evaluate(self.rt, form)
+            result = self.evaluate(self.rt, form)
         return result
 
     def assertFormsEqual(self, expected, actual, msg=None):
@@ -0,0 +1,27 @@
+import sgml.bench
+import tests
+
+
+class TestBench(tests.SgmlTestCase):
+    def test_run_benchmarks(self):
+        results = sgml.bench.run_benchmarks(["generators", "require"], repeat=1)
+        self.assertEqual(["generators", "require"], list(results["benchmarks"]))
+        generators = results["benchmarks"]["generators"]
+        self.assertGreater(generators["wall_time"], 0)
+        self.assertGreater(generators["steps"], 0)
+        self.assertGreater(generators["peak_memory"], 0)
+        # the benchmarks leave things as init() does
+        self.assertRaises(AssertionError, self.eval, "drain")
+
+    def test_compare(self):
+        def results(wall_time, steps, peak_memory):
+            return {
+                "version": sgml.bench.RESULTS_VERSION,
+                "benchmarks": {"fib": {"wall_time": wall_time, "steps": steps, "peak_memory": peak_memory}},
+            }
+        comparison = sgml.bench.compare(results(1.0, 100, 1000), results(1.05, 101, 2000))
+        self.assertEqual([
+            ("fib", "wall_time", 1.0, 1.05, False),
+            ("fib", "steps", 100, 101, True),
+            ("fib", "peak_memory", 1000, 2000, True),
+        ], comparison)
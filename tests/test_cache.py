@@ -0,0 +1,82 @@
+import os
+import tempfile
+
+import sgml.interpreter.compiler
+import sgml.reader
+import tests
+
+
+class TestCache(tests.SgmlTestCase):
+    def test_reset(self):
+        self.eval("""
+            (define foo 1)
+            (define maplist 5)
+            (require lists)
+        """)
+        self.rt.reset()
+        self.assertRaises(AssertionError, self.eval, "foo")
+        self.assertBothEval("(maplist '(1 2) (lambda (x) (+ x 1)))", "'(2 3)")
+        self.assertRaises(AssertionError, self.eval, "lists::append*")
+
+    def test_image(self):
+        image_dir, do_load_file = self.rt.IMAGE_DIR, self.rt._do_load_file
+        with tempfile.TemporaryDirectory() as d:
+            self.rt.IMAGE_DIR = d
+            try:
+                self.rt._cached_core_ns = None
+                self.rt.init()
+                images = os.listdir(d)
+                self.assertEqual(1, len(images))
+
+                def fail(path):
+                    raise AssertionError("evaluated {} instead of loading the image".format(path))
+                self.rt._do_load_file = fail
+                self.rt._cached_core_ns = None
+                self.rt.init()
+                self.assertBothEval("(maplist '(1 2) (lambda (x) (+ x 1)))", "'(2 3)")
+                self.assertBothEval("(foldr + 0 '(1 2 3))", "6")
+                self.assertEqual(6, sgml.interpreter.compiler.evaluate(self.rt, self.eval("'(foldr + 0 '(1 2 3))")))
+                self.rt._do_load_file = do_load_file
+
+                # a damaged image is ignored, and replaced
+                with open(os.path.join(d, images[0]), "wb") as f:
+                    f.write(b"garbage")
+                self.rt._cached_core_ns = None
+                self.rt.init()
+                self.assertBothEval("(foldr + 0 '(1 2 3))", "6")
+                with open(os.path.join(d, images[0]), "rb") as f:
+                    self.assertNotEqual(b"garbage", f.read())
+            finally:
+                self.rt.IMAGE_DIR = image_dir
+                self.rt._do_load_file = do_load_file
+                self.rt._cached_core_ns = None
+
+    def test_forms_cache(self):
+        iter_forms = sgml.reader.iter_forms
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "test.sgml")
+            cache_path = os.path.join(d, "__sgmlcache__", "test.sgml.forms")
+            with open(path, "w") as f:
+                f.write("(define cached 'one)")
+            self.rt.load_file(path)
+            self.assertTrue(os.path.exists(cache_path))
+
+            def fail(*args):
+                raise AssertionError("parsed {} instead of using the cache".format(path))
+            sgml.reader.iter_forms = fail
+            try:
+                self.rt.reset()
+                self.rt.load_file(path)
+            finally:
+                sgml.reader.iter_forms = iter_forms
+            self.assertFormsEqual(self.rt.symbol("one"), self.eval("cached"))
+
+            with open(path, "w") as f:
+                f.write("(define cached 'second)")
+            self.rt.load_file(path)
+            self.assertFormsEqual(self.rt.symbol("second"), self.eval("cached"))
+
+            with open(cache_path, "wb") as f:
+                f.write(b"garbage")
+            self.rt.load_file(path)
+            self.assertFormsEqual(self.rt.symbol("second"), self.eval("cached"))
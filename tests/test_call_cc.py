@@ -1,3 +1,4 @@
+import sgml.interpreter
 import tests
 
 class TestCallCC(tests.SgmlTestCase):
@@ -89,3 +90,44 @@ class TestCallCC(tests.SgmlTestCase):
         """)
         self.assertEqual(4, self.eval("(list-length '(1 2 3 4))"))
         self.assertEqual(self.rt.null(), self.eval("(list-length '(a b . c))"))
+
+    def test_multi_shot(self):
+        self.eval("""
+            (define k nil)
+            (define result (list 1 (call/cc (lambda (c) (set! k c) 2)) 3))
+        """)
+        self.assertBothEval("result", "'(1 2 3)")
+        self.eval("(k 10)")
+        self.assertBothEval("result", "'(1 10 3)")
+        self.eval("(k 20)")
+        self.assertBothEval("result", "'(1 20 3)")
+
+    def test_shift_and_reset(self):
+        self.assertEqual(42, self.eval("(reset (+ 1 (shift (lambda (k) 42))))"))
+        self.assertEqual(21, self.eval("(+ 1 (reset (* 2 (shift (lambda (k) (k (k 5)))))))"))
+        self.assertBothEval("(reset (list 1 (shift (lambda (k) (cons (k 2) (k 3)))) 4))", "'((1 2 4) 1 3 4)")
+        self.assertRaises(RuntimeError, self.eval, "(shift (lambda (k) 1))")
+
+    def test_delimited_generator(self):
+        self.eval("""
+            ;; each element of lst paired with a continuation that resumes the walk
+            (defn walk (lst)
+              (reset
+                (begin
+                  (for-each (lambda (x) (shift (lambda (k) (cons x k)))) lst)
+                  'done)))
+
+            (defn collect (g)
+              (cond ((eq g 'done) nil)
+                    (t (cons (car g) (collect ((cdr g) nil))))))
+
+            (defn deep (n)
+              (cond ((eq n 0) (walk '(1 2 3)))
+                    (t (car (list (deep (- n 1)))))))
+        """)
+        self.assertBothEval("(collect (walk '(1 2 3)))", "'(1 2 3)")
+        self.assertBothEval("(collect (deep 50))", "'(1 2 3)")
+        # the continuation holds the frames inside the reset and no more
+        shallow = sgml.interpreter.stacktrace(self.rt.continuation_frame(self.eval("(cdr (deep 1))")))
+        deep = sgml.interpreter.stacktrace(self.rt.continuation_frame(self.eval("(cdr (deep 50))")))
+        self.assertEqual(len(shallow), len(deep))
@@ -0,0 +1,55 @@
+import sgml.interpreter.compiler
+import tests
+from tests import test_call_cc, test_interpreter, test_stdlib
+
+
+class CompiledCallCCTest(test_call_cc.TestCallCC):
+    evaluate = staticmethod(sgml.interpreter.compiler.evaluate)
+
+
+class CompiledInterpreterTest(test_interpreter.TestInterpreter):
+    evaluate = staticmethod(sgml.interpreter.compiler.evaluate)
+
+
+class CompiledStdlibTest(test_stdlib.TestStdlib):
+    evaluate = staticmethod(sgml.interpreter.compiler.evaluate)
+
+
+class TestCompiler(tests.SgmlTestCase):
+    evaluate = staticmethod(sgml.interpreter.compiler.evaluate)
+
+    def test_define_has_no_value(self):
+        self.assertIsNone(self.eval("(define x 1)"))
+        self.assertEqual(self.rt.forms_to_list([1, 3]), self.eval("(list 1 (define y 2) 3)"))
+        self.assertEqual(2, self.eval("y"))
+
+    def test_deep_recursion_continues_in_frames(self):
+        self.eval("""
+            (defn depth (n)
+              (cond ((eq n 0) 0)
+                    (t (+ 1 (depth (- n 1))))))
+        """)
+        self.assertEqual(2000, self.eval("(depth 2000)"))
+
+    def test_escaping_continuation_from_compiled_code(self):
+        self.eval("""
+            (defn find-first (pred lst)
+              (call/cc
+                (lambda (return)
+                  (for-each (lambda (x) (cond ((pred x) (return x)) (t nil))) lst)
+                  nil)))
+        """)
+        self.assertEqual(3, self.eval("(+ 1 (find-first (lambda (x) (> x 1)) '(1 2 3)))"))
+
+    def test_non_applicable(self):
+        self.assertRaises(RuntimeError, self.eval, "(1 2)")
+
+    def test_unforeseen_binding_shadows_lexical_reference(self):
+        self.eval("""
+            (defn shadowed (x)
+              (let ((y 2))
+                (eval '(label x 10) (get-current-environment))
+                (+ x y)))
+        """)
+        self.assertEqual(12, self.eval("(shadowed 1)"))
+        self.assertEqual(3, self.eval("(let ((x 1) (y 2)) (+ x y))"))
@@ -0,0 +1,65 @@
+import sgml.interpreter
+import tests
+
+
+class TestHooks(tests.SgmlTestCase):
+    def setUp(self):
+        super(TestHooks, self).setUp()
+        self.events = []
+        self.callbacks = {
+            "push": lambda rt, frame: self.events.append(("push", type(frame).__name__)),
+            "pop": lambda rt, frame, value: self.events.append(("pop", type(frame).__name__, value)),
+            "primitive": lambda rt, function, arguments: self.events.append(("primitive", function.name, arguments)),
+            "enter": lambda rt, frame: self.events.append(("enter", frame.combiner.name.text)),
+            "exit": lambda rt, frame, value: self.events.append(("exit", frame.combiner.name.text, value)),
+            "error": lambda rt, frame, exception: self.events.append(("error", type(exception).__name__)),
+        }
+
+    def tearDown(self):
+        for event, callback in self.callbacks.items():
+            sgml.interpreter.remove_hook(event, callback)
+        self.assertEqual({}, sgml.interpreter._hooks)
+        super(TestHooks, self).tearDown()
+
+    def hook(self, *events):
+        for event in events:
+            sgml.interpreter.add_hook(event, self.callbacks[event])
+
+    def of(self, kind):
+        return [e[1:] for e in self.events if e[0] == kind]
+
+    def test_calls(self):
+        self.eval("(defn add1 (x) (+ x 1))")
+        self.hook("primitive", "enter", "exit")
+        self.assertEqual(4, self.eval("(add1 (add1 2))"))
+        self.assertEqual([
+            ("enter", "add1"),
+            ("primitive", "+", (2, (1, False))),
+            ("exit", "add1", 3),
+            ("enter", "add1"),
+            ("primitive", "+", (3, (1, False))),
+            ("exit", "add1", 4),
+        ], self.events)
+
+    def test_push_and_pop(self):
+        self.hook("push", "pop")
+        self.assertEqual(3, self.eval("(+ 1 2)"))
+        plus = self.rt.PRIMITIVE_FUNCTIONS["+"]
+        self.assertEqual([
+            ("push", "DispatchStackFrame"),
+            ("pop", "DispatchStackFrame", plus),
+            ("push", "ApplicativeStackFrame"),
+            ("push", "DispatchStackFrame"),
+            ("pop", "DispatchStackFrame", 1),
+            ("push", "DispatchStackFrame"),
+            ("pop", "DispatchStackFrame", 2),
+            ("pop", "ApplicativeStackFrame", 3),
+        ], self.events)
+
+    def test_error(self):
+        self.hook("error")
+        self.assertRaises(RuntimeError, self.eval, "(1 2)")
+        self.assertEqual([("error", "RuntimeError")], self.events)
+
+    def test_unknown_event(self):
+        self.assertRaises(ValueError, sgml.interpreter.add_hook, "step", print)
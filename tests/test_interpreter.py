@@ -1,6 +1,33 @@
+import sgml.interpreter
 import tests
 
 
+class UnlessStackFrame(sgml.interpreter.StackFrame):
+    __missing = object()
+
+    def __init__(self, scope, parent, predicate, form):
+        super(UnlessStackFrame, self).__init__(scope, parent)
+        self.predicate = predicate
+        self.form = form
+        self.predicate_value = self.__missing
+
+    def with_value(self, rt, value):
+        result = self.writable()
+        result.predicate_value = value
+        return result
+
+    def frame_or_value(self, rt):
+        if self.predicate_value is self.__missing:
+            return sgml.interpreter.DispatchStackFrame(self.scope, self, self.predicate)
+        if rt.is_truthy(self.predicate_value):
+            return rt.null()
+        return sgml.interpreter.DispatchStackFrame(self.scope, self.parent, self.form)
+
+
+def dispatch_unless(rt, frame):
+    return UnlessStackFrame(frame.scope, frame.parent, rt.second(frame.form), rt.third(frame.form))
+
+
 class TestInterpreter(tests.SgmlTestCase):
     def test_arity_error(self):
         def f():
@@ -18,6 +45,9 @@ class TestInterpreter(tests.SgmlTestCase):
         self.assertEqual(19, self.eval("(let ((x nil) (x 19)) x)"))
         self.assertEqual(2, self.eval("(let ((x 1) (x (+ x 1))) x)"))
 
+    def test_let_binding_scopes(self):
+        self.assertEqual(1, self.eval("(let ((x 1) (f (lambda () x)) (x 2)) (f))"))
+
     def test_apply(self):
         self.assertEqual(2, self.eval("(apply (lambda (x) (+ x 1)) (list 1))"))
         self.assertEqual(2, self.eval("(apply (lambda (x) (+ x 1)) (list 1))"))
@@ -28,6 +58,13 @@ class TestInterpreter(tests.SgmlTestCase):
     def test_wrap(self):
         self.assertEqual(4, self.eval("((wrap +) 2 2)"))
 
+    def test_register_special_form(self):
+        if "unless" not in self.rt.SPECIAL_FORMS:
+            self.rt.register_special_form("unless", dispatch_unless)
+        self.rt.init()
+        self.assertEqual(2, self.eval("(unless (eq 1 2) (+ 1 1))"))
+        self.assertEqual(self.rt.null(), self.eval("(unless t (/ 1 0))"))
+
     def test_let2(self):
         self.assertEqual(19, self.eval("""
             (let ((lambda2 (fexpr (formals body) env
@@ -38,3 +75,87 @@ class TestInterpreter(tests.SgmlTestCase):
         """))
 
 
+
+    def test_malformed_branch_checked_when_reached(self):
+        self.eval("(defn pick (x) (cond ((eq x 1) 'one) (oops) (t 'other)))")
+        for _ in range(2):
+            self.assertFormsEqual(self.rt.symbol("one"), self.eval("(pick 1)"))
+            self.assertRaises(RuntimeError, self.eval, "(pick 2)")
+
+    def test_namespaces_are_isolated(self):
+        self.eval("""
+            (define cons 'mine)
+            (define fresh 1)
+        """)
+        self.assertFormsEqual(self.rt.symbol("mine"), self.eval("cons"))
+        self.assertEqual((1, 2), self.eval("(eval '(cons 1 2) (make-environment))"))
+        self.assertRaises(AssertionError, self.eval, "(eval 'fresh (make-environment))")
+        self.eval("(ns other)")
+        self.assertEqual((1, 2), self.eval("(cons 1 2)"))
+        self.assertRaises(AssertionError, self.eval, "fresh")
+        self.assertEqual(6, self.eval("(foldr + 0 '(1 2 3))"))
+
+    def test_body_ending_in_define(self):
+        self.assertFormsEqual(self.rt.IGNORE, self.eval("((lambda () 1 (define x 2)))"))
+        self.assertFormsEqual(self.rt.IGNORE, self.eval("(begin 1 (define x 2))"))
+        self.assertEqual(2, self.eval("x"))
+
+
+class TestTailCalls(tests.SgmlTestCase):
+    def max_depth(self, code):
+        """
+        :return: How long the chain of frames got at any operative call made
+            evaluating `code`
+        """
+        depths = [0]
+        make_operative_stack_frame = sgml.interpreter.make_operative_stack_frame
+
+        def record(rt, scope, parent, func, args):
+            depths.append(len(sgml.interpreter.stacktrace(parent)))
+            return make_operative_stack_frame(rt, scope, parent, func, args)
+        sgml.interpreter.make_operative_stack_frame = record
+        try:
+            self.eval(code)
+        finally:
+            sgml.interpreter.make_operative_stack_frame = make_operative_stack_frame
+        return max(depths)
+
+    def assertConstantSpace(self, loop):
+        """
+        A loop that took space in proportion to its iterations would be twice as
+        deep after twice as many; one that runs in constant space at a million
+        iterations is as deep after 10 as after 1000.
+        """
+        self.assertEqual(self.max_depth("({} 10)".format(loop)), self.max_depth("({} 1000)".format(loop)))
+        self.assertFormsEqual(self.rt.symbol("done"), self.eval("({} 1000)".format(loop)))
+
+    def test_tail_call_in_cond(self):
+        self.eval("(defn count-down (n) (cond ((eq n 0) 'done) (t (count-down (- n 1)))))")
+        self.assertConstantSpace("count-down")
+
+    def test_tail_call_after_other_forms(self):
+        self.eval("""
+            (defn count-down (n)
+              (+ 1 1)
+              (if (eq n 0) 'done (count-down (- n 1))))
+        """)
+        self.assertConstantSpace("count-down")
+
+    def test_tail_call_in_let(self):
+        self.eval("""
+            (defn count-down (n)
+              (let ((m (- n 1)))
+                (if (< m 0) 'done (count-down m))))
+        """)
+        self.assertConstantSpace("count-down")
+
+    def test_mutual_recursion(self):
+        self.eval("""
+            (defn ping (n) (if (eq n 0) 'done (pong (- n 1))))
+            (defn pong (n) (begin (ping n)))
+        """)
+        self.assertConstantSpace("ping")
+
+    def test_non_tail_call(self):
+        self.eval("(defn count-up (n) (if (eq n 0) 0 (+ 1 (count-up (- n 1)))))")
+        self.assertLess(self.max_depth("(count-up 10)"), self.max_depth("(count-up 100)"))
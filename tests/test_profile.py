@@ -0,0 +1,44 @@
+import io
+
+import sgml.interpreter
+import sgml.interpreter.profile
+import tests
+
+
+class TestProfile(tests.SgmlTestCase):
+    def profile(self, code):
+        profiler = sgml.interpreter.profile.Profiler()
+        sgml.interpreter.profiler = profiler
+        try:
+            self.eval(code)
+        finally:
+            sgml.interpreter.profiler = None
+        return profiler
+
+    def test_profile(self):
+        self.eval("""
+            (defn fib (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+            (define square (lambda (x) (* x x)))
+            (define also-square square)
+        """)
+        profiler = self.profile("(maplist (list (fib 6) 2) also-square)")
+        fib = profiler.functions["user::fib"]
+        self.assertEqual(25, fib.calls)
+        self.assertEqual(fib.steps, fib.inclusive_steps)
+        self.assertEqual(2, profiler.functions["user::square"].calls)
+        maplist = profiler.functions["core::maplist"]
+        self.assertEqual(3, maplist.calls)
+        self.assertLess(maplist.steps, maplist.inclusive_steps)
+        self.assertEqual(
+            sum(steps for steps, _ in profiler.stacks.values()),
+            profiler.functions[sgml.interpreter.profile.TOP_LEVEL].inclusive_steps
+        )
+
+        collapsed = io.StringIO()
+        profiler.write_collapsed(collapsed)
+        lines = collapsed.getvalue().splitlines()
+        self.assertIn("<top level>;user::fib;user::fib {}".format(profiler.stacks[("<top level>", "user::fib", "user::fib")][0]), lines)
+        self.assertTrue(any(line.startswith("<top level>;core::maplist;core::maplist;user::square ") for line in lines))
+
+    def test_errors(self):
+        self.assertRaises(RuntimeError, self.profile, "(1 2)")
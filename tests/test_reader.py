@@ -1,3 +1,7 @@
+import io
+import os
+import tempfile
+
 import sgml.reader
 import tests
 
@@ -37,3 +41,88 @@ class TestReader(tests.SgmlTestCase):
         self.assertFormsEqual(
             self.read_one("(quasiquote (1 (unquote some-list) 4 (unquote-splicing some-list)))"),
             self.read_one("`(1 ,some-list 4 ,@some-list)"))
+
+    def test_symbols_are_interned(self):
+        form = self.read_one("(foo bar foo lists::foo)")
+        self.assertIs(self.rt.first(form), self.rt.third(form))
+        self.assertIs(self.rt.first(form), self.rt.symbol("foo"))
+        self.assertIs(self.rt.fourth(form), self.rt.symbol("foo").with_ns("lists"))
+        self.assertIsNot(self.rt.first(form), self.rt.fourth(form))
+
+    def test_error_positions(self):
+        cases = [
+            ("(a b\n  (c", 2, 6, "EOF while reading list"),
+            ('"abc\ndef', 2, 4, "EOF while reading string literal"),
+            ("(a . b c)", 1, 8, "Expected one cdr in dotted s-expression"),
+            ('(a 1 "s\\q")', 1, 9, "Illegal escape character: 'q'"),
+            ("foo bar", 1, 4, 'Unconsumed input: "bar"'),
+            ("  \n)", 2, 1, "Unmatched delimiter: ')'"),
+        ]
+        for code, line, column, message in cases:
+            for stream in (
+                    sgml.reader.streams.StringStream(code),
+                    sgml.reader.streams.FileStream(io.StringIO(code)),
+            ):
+                with self.assertRaises(sgml.reader.streams.StreamError) as cm:
+                    sgml.reader.read_one(
+                        self.rt,
+                        sgml.reader.INITIAL_MACROS,
+                        sgml.reader.streams.LineNumberingStream(stream)
+                    )
+                self.assertEqual((line, column, message), (cm.exception.line, cm.exception.column, cm.exception.message))
+
+    def test_file_stream_blocks(self):
+        code = '(defn f (x) ;; comment\n  (cons "a string\\n" (quote xyzzy)))'
+        stream = sgml.reader.streams.FileStream(io.StringIO(code))
+        stream.BLOCK_SIZE = 3
+        self.assertFormsEqual(self.read_one(code), sgml.reader.read_one(self.rt, sgml.reader.INITIAL_MACROS, stream))
+
+    def test_mmap_stream(self):
+        form = '(défn f (x) ;; → comment\n  (cons "a → string\\n" (quote xyzzy)))'
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "test.sgml")
+            for code in (form, form + "\n(a . b c)", form + "\n(a b"):
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(code)
+                with open(path, "rb") as f:
+                    stream = sgml.reader.streams.MmapStream(f)
+                try:
+                    expected = self.read_with_error(sgml.reader.streams.StringStream(code))
+                    self.assertEqual(expected, self.read_with_error(stream))
+                finally:
+                    stream.close()
+
+    def read_with_error(self, stream):
+        try:
+            return self.rt.as_string(sgml.reader.read_many(
+                self.rt,
+                sgml.reader.INITIAL_MACROS,
+                sgml.reader.streams.LineNumberingStream(stream)
+            ))
+        except sgml.reader.streams.StreamError as e:
+            return e.line, e.column, e.message, stream.remainder()
+
+    def test_large_files_are_mapped(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "test.sgml")
+            with open(path, "w") as f:
+                f.write("(define mapped 'yes)")
+            threshold = sgml.reader.streams.MMAP_THRESHOLD
+            sgml.reader.streams.MMAP_THRESHOLD = 0
+            try:
+                with sgml.reader.streams.open_file(path) as stream:
+                    self.assertIsInstance(stream, sgml.reader.streams.MmapStream)
+                self.rt.load_file(path)
+            finally:
+                sgml.reader.streams.MMAP_THRESHOLD = threshold
+        self.assertFormsEqual(self.rt.symbol("yes"), self.eval("mapped"))
+
+    def test_iter_forms(self):
+        forms = sgml.reader.iter_forms(
+            self.rt,
+            sgml.reader.INITIAL_MACROS,
+            sgml.reader.streams.StringStream("(a b) ; comment\n c (d")
+        )
+        self.assertFormsEqual(self.read_one("(a b)"), next(forms))
+        self.assertFormsEqual(self.rt.symbol("c"), next(forms))
+        self.assertRaises(sgml.reader.streams.StreamError, next, forms)
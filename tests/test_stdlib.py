@@ -100,3 +100,82 @@ class TestStdlib(tests.SgmlTestCase):
         self.assertBothEval(
             "(require lists) (lists::append* '(1 2) '(3) '(4 5 6) '(7 8))",
             "'(1 2 3 4 5 6 7 8)")
+
+    def test_begin(self):
+        self.assertBothEval("(begin 1 2 3)", "3")
+        self.assertFormsEqual(self.rt.IGNORE, self.eval("(begin)"))
+        self.assertEqual(2, self.eval("""
+            (let ((e (get-current-environment)))
+              (begin (eval '(label x 2) e) x))
+        """))
+
+    def test_defn(self):
+        self.assertFormsEqual(self.rt.IGNORE, self.eval("(defn inc (x) (+ x 1))"))
+        self.assertEqual(3, self.eval("(inc 2)"))
+        self.assertEqual(2, self.eval("((lambda ((a . b)) b) (cons 1 2))"))
+
+    def test_apply_in_environment(self):
+        self.assertEqual(5, self.eval("""
+            (let ((y 4)
+                  (f (fexpr (x) e (+ (eval x e) 1))))
+              (apply (wrap f) (list 'y) (get-current-environment)))
+        """))
+        self.assertEqual(3, self.eval("(apply + (list 1 2))"))
+
+    def test_delay_and_force(self):
+        self.eval("""
+            (define forced 0)
+            (define p (delay (begin (set! forced (+ forced 1)) (list forced))))
+        """)
+        self.assertEqual(0, self.eval("forced"))
+        self.assertBothEval("(force p)", "'(1)")
+        self.assertBothEval("(force p)", "'(1)")
+        self.assertEqual(1, self.eval("forced"))
+        self.assertEqual(3, self.eval("(force 3)"))
+        self.assertEqual(4, self.eval("(force (delay (delay 4)))"))
+
+    def test_lazy_sequences(self):
+        self.eval("""
+            (require lazy)
+            (define naturals (lazy::iterate (lambda (x) (+ x 1)) 0))
+            (defn odd? (x) (eq 1 (- x (* 2 (/ (- x 1) 2)))))
+        """)
+        self.assertBothEval("(lazy::to-list (lazy::take 3 naturals))", "'(0 1 2)")
+        self.assertBothEval("""
+            (lazy::to-list (lazy::take 4 (lazy::map (lambda (x) (* x x)) (lazy::drop 2 naturals))))
+        """, "'(4 9 16 25)")
+        # take doesn't look past the last element it takes, which here doesn't exist
+        self.assertBothEval("""
+            (lazy::to-list (lazy::take 2 (lazy::filter (lambda (x) (< x 2)) naturals)))
+        """, "'(0 1)")
+        self.assertBothEval("(lazy::to-list (lazy::range 3 6))", "'(3 4 5)")
+        # car, cdr and null force their way along, so list functions work too
+        self.assertBothEval("(maplist (lazy::range 0 3) (lambda (x) (+ x 10)))", "'(10 11 12)")
+        self.assertEqual(3, self.eval("(length (lazy::range 0 3))"))
+        self.assertEqual(4950, self.eval("(foldl + 0 (lazy::take 100 naturals))"))
+        self.assertEqual(2, self.eval("(car (cdr (cdr naturals)))"))
+
+    def test_lazy_sequences_are_lazy(self):
+        self.eval("""
+            (require lazy)
+            (define calls 0)
+            (define squares (lazy::map (lambda (x) (set! calls (+ calls 1)) (* x x)) (lazy::range 0 10)))
+        """)
+        self.assertEqual(1, self.eval("calls"))
+        self.assertBothEval("(lazy::to-list (lazy::take 3 squares))", "'(0 1 4)")
+        self.assertEqual(3, self.eval("calls"))
+        # the elements already computed are remembered
+        self.assertBothEval("(lazy::to-list (lazy::take 3 squares))", "'(0 1 4)")
+        self.assertEqual(3, self.eval("calls"))
+
+
+class PureCoreStdlibTest(TestStdlib):
+    """
+    TestStdlib with lambda, defn, if, and, begin and apply defined in sgml
+    """
+    def setUp(self):
+        super(PureCoreStdlibTest, self).setUp()
+        self.rt.init(native_core=False)
+
+    def tearDown(self):
+        self.rt.init()